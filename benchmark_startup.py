@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Measure the startup time of each entry point, by running it with --help, which
+exits right after importing its modules and building its argument parser.
+'''
+
+import argparse, subprocess, sys, time, os
+
+ENTRY_POINTS = ['detect_pies.py', 'combine_extracted_idioms.py', 'evaluate_extraction.py', 'benchmark_tokenizers.py', 'compare_inflectors.py']
+LIBRARY_MODULES = ['config', 'utils', 'idiom_matcher', 'process_corpus']
+
+# Read in arguments
+parser = argparse.ArgumentParser(description = 'Parameters for startup benchmark')
+parser.add_argument('-r', '--repeat', metavar = 'N', type = int, default = 5, help = "Number of times to start each entry point. Default is 5.")
+args = parser.parse_args()
+
+def time_command(command):
+	'''Runs a command args.repeat times, returns the fastest and mean wall-clock time, or None if it fails.'''
+
+	timings = []
+	with open(os.devnull, 'w') as devnull:
+		for i in range(args.repeat):
+			time_0 = time.time()
+			return_code = subprocess.call(command, stdout = devnull, stderr = devnull)
+			timings.append(time.time() - time_0)
+			if return_code != 0:
+				return None
+
+	return min(timings), sum(timings) / len(timings)
+
+# Time a bare interpreter as baseline, then entry points and library imports
+commands = [('python (baseline)', [sys.executable, '-c', 'pass'])]
+commands += [(entry_point + ' --help', [sys.executable, entry_point, '--help']) for entry_point in ENTRY_POINTS]
+commands += [('import ' + module, [sys.executable, '-c', 'import ' + module]) for module in LIBRARY_MODULES]
+for name, command in commands:
+	timing = time_command(command)
+	if timing:
+		print '{0}: fastest {1:.3f} seconds, mean {2:.3f} seconds'.format(name, timing[0], timing[1])
+	else:
+		print '{0}: failed, missing dependencies?'.format(name)
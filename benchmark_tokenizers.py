@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Compare the Spacy tokenizer and the simple built-in tokenizer in terms of loading time,
+tokenization speed, and agreement of token offsets on a one-sentence-per-line corpus.
+'''
+
+import argparse, time
+
+import utils
+
+# Read in arguments
+parser = argparse.ArgumentParser(description = 'Parameters for tokenizer benchmark')
+parser.add_argument('corpus', metavar = 'CORPUS', type = str, nargs = '?', default = 'data/input_sample.txt', help = "Specify the location of a plain text, one-sentence-per-line corpus. Default is 'data/input_sample.txt'.")
+parser.add_argument('-r', '--repeat', metavar = 'N', type = int, default = 1, help = "Number of times to tokenize the corpus, to get more stable timings. Default is 1.")
+args = parser.parse_args()
+
+# Read input data
+sentences = []
+with open(args.corpus, 'r') as f:
+	for line in f:
+		line = line.strip()
+		if line:
+			sentences.append(unicode(line, 'utf-8'))
+print 'Read {0} sentences from {1}'.format(len(sentences), args.corpus)
+
+# Tokenize corpus with both tokenizers
+token_offsets = {}
+for tokenizer_type in ['spacy', 'simple']:
+	time_0 = time.time()
+	tokenizer = utils.load_tokenizer(tokenizer_type)
+	load_time = time.time() - time_0
+	time_0 = time.time()
+	for i in range(args.repeat):
+		tokenized_sentences = utils.tokenize_batch(tokenizer, sentences)
+	tokenize_time = time.time() - time_0
+	token_offsets[tokenizer_type] = [[(token.idx, token.idx + len(token.text)) for token in tokenized_sentence] for tokenized_sentence in tokenized_sentences]
+	print '{0}: loading took {1:.2f} seconds, tokenizing took {2:.2f} seconds ({3:.0f} sentences per second)'.format(tokenizer_type, load_time, tokenize_time, len(sentences) * args.repeat / max(tokenize_time, 1e-6))
+
+# Compare token offsets
+num_identical = sum([1 for spacy_offsets, simple_offsets in zip(token_offsets['spacy'], token_offsets['simple']) if spacy_offsets == simple_offsets])
+print 'Identical token offsets in {0} of {1} sentences ({2:.2f}%)'.format(num_identical, len(sentences), 100. * num_identical / max(len(sentences), 1))
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Check that the batched interfaces to morpha and morphg give the same output as running
+the tools once per call, the way they were originally run: one process per list of tokens,
+without a trailing newline, output split on spaces. By default, runs against the stand-in
+tools in data/morph_standin, which need no morph installation, use --morph-dir to check
+the real morph tools.
+'''
+
+import argparse, random, sys, time, os, shlex, subprocess
+
+import utils
+
+# Read in arguments
+parser = argparse.ArgumentParser(description = 'Parameters for morph batch check')
+parser.add_argument('-md', '--morph-dir', metavar = 'DIR', type = str, default = './data/morph_standin', help = "Specify the location of the morph tools. Default is the stand-in tools in './data/morph_standin'.")
+parser.add_argument('-n', '--num-lines', metavar = 'N', type = int, default = 200, help = "Number of random lines to check. Default is 200.")
+parser.add_argument('-b', '--batch-size', metavar = 'N', type = int, default = 30, help = "Number of lines per batch, small enough to get several batches. Default is 30.")
+parser.add_argument('-w', '--workers', metavar = 'N', type = int, default = 4, help = "Number of batches run in parallel. Default is 4.")
+parser.add_argument('-s', '--seed', metavar = 'N', type = int, default = 0, help = "Random seed. Default is 0.")
+args = parser.parse_args()
+morph_dir = os.path.abspath(args.morph_dir)
+
+def morpha_once(morph_dir, tokens, keep_case = True, keep_pos = False):
+	'''Runs morpha in its own process on a single list of tokens, returns list of uninflected tokens.'''
+
+	call = shlex.split('{0}/morpha {1} {0}/verbstem.list'.format(morph_dir, utils.get_morph_flags(keep_case, keep_pos)))
+	process = subprocess.Popen(call, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+	output = process.communicate(input=' '.join(tokens))
+
+	return output[0].split(' ')
+
+def morphg_once(morph_dir, tokens, keep_case = True, keep_pos = False):
+	'''Runs morphg in its own process on a single list of tokens, returns tuple of inflected tokens.'''
+
+	call = shlex.split('{0}/morphg {1} {0}/verbstem.list'.format(morph_dir, utils.get_morph_flags(keep_case, keep_pos)))
+	process = subprocess.Popen(call, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+	output = process.communicate(input=' '.join(tokens))
+
+	# Filter out failed inflections, which will still contain '+'
+	return tuple([i_t for i_t in output[0].split(' ') if not '+' in i_t])
+
+# Generate random lines of tagged tokens for morpha, and of inflection requests for morphg, never empty, like idiom words
+random.seed(args.seed)
+WORDS = ['shoot', 'shoots', 'shooting', 'bean', 'beans', 'spilled', 'the', 'into', 'beg', 'stop', 'admitted', 'xylophone', 'Walks']
+TAGS = ['NN', 'NNS', 'VB', 'VBD', 'VBG', 'VBZ', 'DT', 'IN', 'JJ']
+INFLECTIONS = ['s_N', 's_V', 'ing_V', 'ed_V', 'en_V']
+morpha_lines = [[random.choice(WORDS) + '_' + random.choice(TAGS) for i in range(random.randint(1, 5))] for j in range(args.num_lines)]
+morphg_lines = [[random.choice(WORDS) + '+' + random.choice(INFLECTIONS) for i in range(random.randint(1, 4))] for j in range(args.num_lines)]
+
+num_failures = 0
+for name, batch_function, line_function, lines in [('morpha', utils.morpha_batch, morpha_once, morpha_lines), ('morphg', utils.morphg_batch, morphg_once, morphg_lines)]:
+	for keep_case in [True, False]:
+		for keep_pos in [True, False]:
+			time_0 = time.time()
+			line_outputs = [line_function(morph_dir, tokens, keep_case = keep_case, keep_pos = keep_pos) for tokens in lines]
+			time_1 = time.time()
+			batch_outputs = batch_function(morph_dir, lines, keep_case = keep_case, keep_pos = keep_pos, num_workers = args.workers, batch_size = args.batch_size)
+			time_2 = time.time()
+			num_different = sum([line_output != batch_output for line_output, batch_output in zip(line_outputs, batch_outputs)])
+			num_different += abs(len(line_outputs) - len(batch_outputs))
+			num_failures += num_different
+			print '{0} (keep case: {1}, keep PoS: {2}): {3} of {4} lines differ, once per line took {5:.2f} seconds, batched took {6:.2f} seconds'.format(name, keep_case, keep_pos, num_different, len(lines), time_1 - time_0, time_2 - time_1)
+
+if num_failures:
+	print 'FAILED: batched and single-shot output differ on {0} lines'.format(num_failures)
+	sys.exit(1)
+print 'OK: batched and single-shot output are identical'
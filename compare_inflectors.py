@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Check agreement between the inflectional variants generated by the morph tools and by the built-in Python inflector.
+'''
+
+import json, argparse, os
+
+import utils
+
+# Read in arguments
+parser = argparse.ArgumentParser(description = 'Parameters for inflector comparison')
+parser.add_argument('idiom_lists', metavar = 'idiom_list.json', type = str, nargs = '+', help = "Specify one or more files containing idiom lists, e.g. the cached idiom lists in the working directory.")
+parser.add_argument('-md', '--morph-dir', metavar = 'DIR', type = str, default = './ext/morph', help = "Specify the location of the morph tools. Default is './ext/morph'.")
+parser.add_argument('-n', '--num-examples', metavar = 'N', type = int, default = 25, help = "Number of disagreeing words to show. Default is 25.")
+args = parser.parse_args()
+
+# Read input data
+idioms = set()
+for idiom_list in args.idiom_lists:
+	with open(idiom_list, 'r') as f:
+		idioms.update(json.load(f))
+idioms = sorted(idioms)
+print 'Read {0} idioms from {1} file(s)'.format(len(idioms), len(args.idiom_lists))
+
+# Inflect idioms with both backends
+morph_inflections = utils.generate_inflections(idioms, os.path.abspath(args.morph_dir), backend = 'morph')
+python_inflections = utils.generate_inflections(idioms, os.path.abspath(args.morph_dir), backend = 'python')
+
+# Compare word forms of inflected words
+num_words = 0
+num_agreeing_words = 0
+num_agreeing_idioms = 0
+disagreements = []
+for idiom in idioms:
+	morph_word_forms = morph_inflections.get(idiom, [])
+	python_word_forms = python_inflections.get(idiom, [])
+	if morph_word_forms == python_word_forms:
+		num_agreeing_idioms += 1
+	for morph_forms, python_forms in map(None, morph_word_forms, python_word_forms):
+		# Only count words which have inflections
+		if len(morph_forms or ()) <= 1 and len(python_forms or ()) <= 1:
+			continue
+		num_words += 1
+		if morph_forms == python_forms:
+			num_agreeing_words += 1
+		else:
+			disagreements.append((idiom, morph_forms, python_forms))
+
+print 'Identical inflections for {0} of {1} inflected words ({2:.2f}%)'.format(num_agreeing_words, num_words, 100. * num_agreeing_words / max(num_words, 1))
+print 'Identical inflections for {0} of {1} idioms ({2:.2f}%)'.format(num_agreeing_idioms, len(idioms), 100. * num_agreeing_idioms / max(len(idioms), 1))
+for idiom, morph_forms, python_forms in disagreements[:args.num_examples]:
+	print utils.u8(idiom)
+	print '\tmorph:  {0}'.format(utils.u8(u' '.join(morph_forms or ())))
+	print '\tpython: {0}'.format(utils.u8(u' '.join(python_forms or ())))
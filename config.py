@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-'''Set parameters, parse and validate command-line arguments'''
+'''Set parameters, parse and validate command-line arguments into a configuration object'''
 
 import argparse, os, datetime, re
 
@@ -14,72 +14,148 @@ UE_URL = 'https://www.usingenglish.com'
 UE_IDOMS_URL = UE_URL + '/reference/idioms'
 OX_URL = 'http://www.oxfordreference.com'
 OX_LANDING_URL = OX_URL + '/view/10.1093/acref/9780199543793.001.0001/acref-9780199543793?pageSize=100' # Requires access through e.g. a library
+BLOCK_SIZE = 1000 # Number of sentences per block of work for string matching worker processes
+CHUNK_SENTENCES = 100 # Maximum number of sentences per chunk of plain text for parse-based extraction
+CHUNK_CHARACTERS = 100000 # Maximum number of characters per chunk of plain text for parse-based extraction, well below Spacy's maximum text length
 
 # Read in arguments
-parser = argparse.ArgumentParser(description = 'Parameters for PIE detection')
-parser.add_argument('-d', '--dict', metavar = 'wiktionary|ue|oxford|intersection|2of3|union', type = str, default = 'wiktionary', help = "Specify which dictionary to use, default is 'wiktionary'. Other options are 'ue' for UsingEnglish.com, 'oxford' for Oxford Dictionary of English Idioms, 'intersection' for idioms occurring in all three dictionaries, '2of3' for idioms occurring in at least two of the three dictionaries, and 'union' for all idioms occurring in at least one of the three dictionaries. To get the intersection of a pair of dictionaries, enter two dictionary names, separated by a comma, e.g. 'wiktionary,oxford'.")
-parser.add_argument('corpus', metavar = 'CORPUS', type = str, help = "Specify the location of the corpus to extract PIEs from.")
-parser.add_argument('-t', '--corpus-type', metavar = 'plain|bnc|bnc-dev|bnc-test', type = str, default = 'plain', help = "Specify the type of corpus used. Plain text or BNC (all and dev/test sets).")
-parser.add_argument('-m', '--method', metavar = 'exact|fuzzy|inflect|parse', type = str, default = 'exact', help = "Specify the extraction method to use. 'exact' for exact string matching, 'fuzzy' for fuzzy/ string matching, 'inflect' for inflectional string matching, 'parse' for parse-based extraction.")
-parser.add_argument('-p', '--parser', metavar = 'spacy|stanford', type = str, default = 'spacy', help = "Specify whether to use the Spacy or Stanford parser for parse-based extraction")
-parser.add_argument('-ex', '--example-sentences', metavar = 'CORPUS', type = str, help = "With the 'parse' method, specify this option to retrieve example sentences for in-context parsing. Specify a path to a corpus or to the file containing the cached output of this method.")
-parser.add_argument('-iw', '--intervening-words', metavar = 'N', type = int, default = 0, help = "Number of intervening words allowed between words of an idiom in the string match methods. Default is 0.")
-parser.add_argument('-c', '--context', metavar = '{0-9}+{ws}', type = str, default = '0s', help = "Amount of context to extract around the idiom. Can be a number of words or sentences. '0w' will yield only the idiom, '1w' one word of context on both sides of the idiom, etc. Word-contexts never exceed sentence boundaries. '0s' will yield only the sentence containing the idiom.")
-parser.add_argument('-o', '--output', metavar = 'OUTFILE', type = str, help = "Specify where to output the extracted idioms. Default is WORK_DIR/extracted_idioms_from_CORPUS_NAME_TIMESTAMP.")
-parser.add_argument('-nc', '--no-cache', action = 'store_true', help = "Do not use a cached idiom list.")
-parser.add_argument('-ns', '--no-split', action = 'store_true', help = "In case of a one-sentence-per-line corpus, do not apply automatic sentence splitting. Does not affect parser-based extraction.")
-parser.add_argument('-cs', '--case-sensitive', action = 'store_true', help = "Make string-matching methods case sensitive.")
-parser.add_argument('-nl', '--no-labels', action = 'store_true', help = "Ignore dependency relation labels during parse-based extraction")
-parser.add_argument('-nld', '--no-labels-or-directionality', action = 'store_true', help = "Ignore dependency relation labels AND dependency relation direction during parse-based extraction.")
-args = parser.parse_args()
-
-# Store arguments as parameters and do validation
-DICT = args.dict.split(',')
-if len(DICT) == 1 and DICT[0] not in ['wiktionary', 'ue', 'oxford', 'intersection', '2of3', 'union']:
-	raise ValueError("No valid dictionary option specified.")
-elif len(DICT) == 2 and (DICT[0] not in ['wiktionary', 'ue', 'oxford'] or DICT[1] not in ['wiktionary', 'ue', 'oxford']):
-	raise ValueError("No valid dictionary option specified.")
-elif len(DICT) < 1 or len(DICT) > 2:
-	raise ValueError("No valid dictionary option specified.")
-
-CORPUS = os.path.abspath(args.corpus)
-if not os.path.exists(CORPUS):
-	raise ValueError("Corpus not found.")
-
-if args.corpus_type in ['plain', 'bnc', 'bnc-dev', 'bnc-test']:
-	CORPUS_TYPE = args.corpus_type
-else:
-	raise ValueError("No valid corpus type specified.")
-
-if args.method in ['exact', 'fuzzy', 'inflect', 'parse']:
-	METHOD = args.method
-else:
-	raise ValueError("No valid extraction method specified.")
-
-if args.parser.lower() in ['spacy', 'stanford']:
-	PARSER = args.parser.lower()
-else:
-	raise ValueError("No valid parser specified.")
-
-INT_WORDS = args.intervening_words
-
-SENTENCES = args.example_sentences
-if SENTENCES:
-	SENTENCES = os.path.abspath(args.example_sentences)
-
-if re.match('[0-9]+[ws]', args.context):
-	CONTEXT_NUMBER = int(args.context[:-1])
-	CONTEXT_TYPE = args.context[-1]
-else:
-	raise ValueError("No valid context window argument provided. Should be of the format [0-9]+[ws].")	
-
-if not args.output: # Set default
-	OUTFILE = os.path.abspath(os.path.join(WORK_DIR, 'extracted_idioms_from_{0}_{1}.csv'.format(CORPUS.split('/')[-1],TIME)))
-else: 
-	OUTFILE = os.path.abspath(args.output)
-
-NO_CACHE = args.no_cache
-NO_SPLIT = args.no_split
-CASE_SENSITIVE = args.case_sensitive
-NO_LABELS = args.no_labels or args.no_labels_or_directionality
-NO_DIRECTION = args.no_labels_or_directionality
+def get_argument_parser():
+	'''Builds the parser for command-line arguments'''
+
+	parser = argparse.ArgumentParser(description = 'Parameters for PIE detection')
+	parser.add_argument('-d', '--dict', metavar = 'wiktionary|ue|oxford|intersection|2of3|union', type = str, default = 'wiktionary', help = "Specify which dictionary to use, default is 'wiktionary'. Other options are 'ue' for UsingEnglish.com, 'oxford' for Oxford Dictionary of English Idioms, 'intersection' for idioms occurring in all three dictionaries, '2of3' for idioms occurring in at least two of the three dictionaries, and 'union' for all idioms occurring in at least one of the three dictionaries. To get the intersection of a pair of dictionaries, enter two dictionary names, separated by a comma, e.g. 'wiktionary,oxford'.")
+	parser.add_argument('corpus', metavar = 'CORPUS', type = str, help = "Specify the location of the corpus to extract PIEs from.")
+	parser.add_argument('-t', '--corpus-type', metavar = 'plain|bnc|bnc-dev|bnc-test', type = str, default = 'plain', help = "Specify the type of corpus used. Plain text or BNC (all and dev/test sets).")
+	parser.add_argument('-m', '--method', metavar = 'exact|fuzzy|inflect|parse', type = str, default = 'exact', help = "Specify the extraction method to use. 'exact' for exact string matching, 'fuzzy' for fuzzy/ string matching, 'inflect' for inflectional string matching, 'parse' for parse-based extraction.")
+	parser.add_argument('-p', '--parser', metavar = 'spacy|stanford', type = str, default = 'spacy', help = "Specify whether to use the Spacy or Stanford parser for parse-based extraction")
+	parser.add_argument('-ex', '--example-sentences', metavar = 'CORPUS', type = str, help = "With the 'parse' method, specify this option to retrieve example sentences for in-context parsing. Specify a path to a corpus or to the file containing the cached output of this method.")
+	parser.add_argument('-e', '--engine', metavar = 'regex|trie', type = str, default = 'regex', help = "Specify the matching engine for the string match methods. 'regex' for a single regular expression containing all idioms, 'trie' for a token-level trie of all idioms, which scales better to large dictionaries and to many intervening words. Both yield the same matches. Default is 'regex'.")
+	parser.add_argument('-in', '--inflector', metavar = 'morph|python', type = str, default = 'morph', help = "Specify how to generate inflectional variants for the 'inflect' method. 'morph' for the morpha and morphg tools, 'python' for Spacy lemmata and a built-in inflector, which only needs morph's verbstem.list. Default is 'morph'.")
+	parser.add_argument('-tk', '--tokenizer', metavar = 'spacy|simple', type = str, default = 'spacy', help = "Specify the tokenizer used to extract n-word context in the string match methods. 'spacy' for the Spacy tokenizer, 'simple' for a built-in regex-based tokenizer, which approximates Spacy's tokenization on ordinary text, but does not need to load a Spacy model. Default is 'spacy'.")
+	parser.add_argument('-iw', '--intervening-words', metavar = 'N', type = int, default = 0, help = "Number of intervening words allowed between words of an idiom in the string match methods. Default is 0.")
+	parser.add_argument('-c', '--context', metavar = '{0-9}+{ws}', type = str, default = '0s', help = "Amount of context to extract around the idiom. Can be a number of words or sentences. '0w' will yield only the idiom, '1w' one word of context on both sides of the idiom, etc. Word-contexts never exceed sentence boundaries. '0s' will yield only the sentence containing the idiom.")
+	parser.add_argument('-o', '--output', metavar = 'OUTFILE', type = str, help = "Specify where to output the extracted idioms. Default is WORK_DIR/extracted_idioms_from_CORPUS_NAME_TIMESTAMP.")
+	parser.add_argument('-w', '--workers', metavar = 'N', type = int, default = 1, help = "Number of worker processes to use for the string match methods, and for parsing with Spacy in the 'parse' method. Default is 1.")
+	parser.add_argument('-pb', '--parse-batch-size', metavar = 'N', type = int, default = 1000, help = "Number of sentences per batch when parsing with Spacy in the 'parse' method, or per request to a Stanford CoreNLP server. Default is 1000.")
+	parser.add_argument('-ss', '--stanford-servers', metavar = 'N', type = int, default = 1, help = "Number of local Stanford CoreNLP servers to start for the 'parse' method with the Stanford parser. Requests are spread over the servers. Each server uses 6GB of memory. Default is 1.")
+	parser.add_argument('-su', '--stanford-urls', metavar = 'URL[,URL]', type = str, help = "Use running Stanford CoreNLP servers at these comma-separated URLs, e.g. 'http://localhost:9000', instead of starting local servers.")
+	parser.add_argument('-nc', '--no-cache', action = 'store_true', help = "Do not use a cached idiom list, idiom inflections, idiom matcher, idiom patterns or parsed corpus.")
+	parser.add_argument('-ns', '--no-split', action = 'store_true', help = "In case of a one-sentence-per-line corpus, do not apply automatic sentence splitting. Does not affect parser-based extraction.")
+	parser.add_argument('-cs', '--case-sensitive', action = 'store_true', help = "Make string-matching methods case sensitive.")
+	parser.add_argument('-lm', '--lemma-match', action = 'store_true', help = "With the 'inflect' method, match each inflected idiom word by any of its word forms, rather than generating all combinations of inflected words as separate idioms. Keeps the number of idioms equal to the dictionary size.")
+	parser.add_argument('-nl', '--no-labels', action = 'store_true', help = "Ignore dependency relation labels during parse-based extraction")
+	parser.add_argument('-nld', '--no-labels-or-directionality', action = 'store_true', help = "Ignore dependency relation labels AND dependency relation direction during parse-based extraction.")
+
+	return parser
+
+class Config:
+	'''
+	Parameters for PIE detection. Holds the non-argument parameters, and the validated
+	command-line arguments, so that importing this module has no side effects.
+	'''
+
+	# Non-argument parameters
+	WORK_DIR = WORK_DIR
+	EXT_DIR = EXT_DIR
+	MORPH_DIR = MORPH_DIR
+	TIME = TIME
+	UE_URL = UE_URL
+	UE_IDOMS_URL = UE_IDOMS_URL
+	OX_URL = OX_URL
+	OX_LANDING_URL = OX_LANDING_URL
+	BLOCK_SIZE = BLOCK_SIZE
+	CHUNK_SENTENCES = CHUNK_SENTENCES
+	CHUNK_CHARACTERS = CHUNK_CHARACTERS
+
+	def __init__(self, args):
+		'''Stores arguments as parameters and does validation'''
+
+		self.DICT = args.dict.split(',')
+		if len(self.DICT) == 1 and self.DICT[0] not in ['wiktionary', 'ue', 'oxford', 'intersection', '2of3', 'union']:
+			raise ValueError("No valid dictionary option specified.")
+		elif len(self.DICT) == 2 and (self.DICT[0] not in ['wiktionary', 'ue', 'oxford'] or self.DICT[1] not in ['wiktionary', 'ue', 'oxford']):
+			raise ValueError("No valid dictionary option specified.")
+		elif len(self.DICT) < 1 or len(self.DICT) > 2:
+			raise ValueError("No valid dictionary option specified.")
+
+		self.CORPUS = os.path.abspath(args.corpus)
+		if not os.path.exists(self.CORPUS):
+			raise ValueError("Corpus not found.")
+
+		if args.corpus_type in ['plain', 'bnc', 'bnc-dev', 'bnc-test']:
+			self.CORPUS_TYPE = args.corpus_type
+		else:
+			raise ValueError("No valid corpus type specified.")
+
+		if args.method in ['exact', 'fuzzy', 'inflect', 'parse']:
+			self.METHOD = args.method
+		else:
+			raise ValueError("No valid extraction method specified.")
+
+		if args.parser.lower() in ['spacy', 'stanford']:
+			self.PARSER = args.parser.lower()
+		else:
+			raise ValueError("No valid parser specified.")
+
+		if args.engine.lower() in ['regex', 'trie']:
+			self.ENGINE = args.engine.lower()
+		else:
+			raise ValueError("No valid matching engine specified.")
+
+		if args.inflector.lower() in ['morph', 'python']:
+			self.INFLECTOR = args.inflector.lower()
+		else:
+			raise ValueError("No valid inflector specified.")
+
+		if args.tokenizer.lower() in ['spacy', 'simple']:
+			self.TOKENIZER = args.tokenizer.lower()
+		else:
+			raise ValueError("No valid tokenizer specified.")
+
+		self.INT_WORDS = args.intervening_words
+
+		if args.workers >= 1:
+			self.WORKERS = args.workers
+		else:
+			raise ValueError("Number of workers should be at least 1.")
+
+		if args.parse_batch_size >= 1:
+			self.PARSE_BATCH_SIZE = args.parse_batch_size
+		else:
+			raise ValueError("Parse batch size should be at least 1.")
+
+		if args.stanford_servers >= 1:
+			self.STANFORD_SERVERS = args.stanford_servers
+		else:
+			raise ValueError("Number of Stanford servers should be at least 1.")
+
+		self.STANFORD_URLS = args.stanford_urls
+		if self.STANFORD_URLS:
+			self.STANFORD_URLS = self.STANFORD_URLS.split(',')
+
+		self.SENTENCES = args.example_sentences
+		if self.SENTENCES:
+			self.SENTENCES = os.path.abspath(args.example_sentences)
+
+		if re.match('[0-9]+[ws]', args.context):
+			self.CONTEXT_NUMBER = int(args.context[:-1])
+			self.CONTEXT_TYPE = args.context[-1]
+		else:
+			raise ValueError("No valid context window argument provided. Should be of the format [0-9]+[ws].")	
+
+		if not args.output: # Set default
+			self.OUTFILE = os.path.abspath(os.path.join(WORK_DIR, 'extracted_idioms_from_{0}_{1}.csv'.format(self.CORPUS.split('/')[-1],TIME)))
+		else: 
+			self.OUTFILE = os.path.abspath(args.output)
+
+		self.NO_CACHE = args.no_cache
+		self.NO_SPLIT = args.no_split
+		self.CASE_SENSITIVE = args.case_sensitive
+		self.LEMMA_MATCH = args.lemma_match
+		self.NO_LABELS = args.no_labels or args.no_labels_or_directionality
+		self.NO_DIRECTION = args.no_labels_or_directionality
+
+def parse_args(argv = None):
+	'''Parses and validates command-line arguments (default: sys.argv), returns Config object'''
+
+	return Config(get_argument_parser().parse_args(argv))
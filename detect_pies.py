@@ -5,13 +5,13 @@
 
 import config
 import process_corpus
-import wiktionary
-import using_english
-import oxford
 import utils
+import idiom_matcher
+import idiom_pattern
 from utils import u8
 
-import re, os, json, random, time
+import re, os, json, random, time, multiprocessing, itertools, bisect
+from collections import Counter
 
 def combine_sets(combination_type, a, b, c = []):
 	'''Combines 2/3 sets of idioms in different ways'''
@@ -28,10 +28,12 @@ def combine_sets(combination_type, a, b, c = []):
 		else:
 			return list(set(a) | set(b))
 
-def get_idiom_list(dictionary_type = config.DICT, case_sensitive = False):
+def get_idiom_list(dictionary_type = None, case_sensitive = False):
 	'''Gets idiom list, either from file or via API'''
 
 	# Read in dictionary type
+	if dictionary_type is None:
+		dictionary_type = config.DICT
 	if len(dictionary_type) == 1:
 		dictionary_type = dictionary_type[0]
 	elif len(dictionary_type) != 2:
@@ -48,11 +50,15 @@ def get_idiom_list(dictionary_type = config.DICT, case_sensitive = False):
 				break
 		# Don't use the cached list, but scrape a new one
 		if not os.path.isfile(ifn) or config.NO_CACHE:
+			# Scrapers are only imported when needed, as they load their HTML-parsing dependencies
 			if dictionary_type == 'wiktionary':
+				import wiktionary
 				idioms = wiktionary.get_category_members(category = 'English idioms')
 			if dictionary_type == 'ue':
+				import using_english
 				idioms = using_english.get_idioms(config.UE_URL, config.UE_IDOMS_URL)
 			if dictionary_type == 'oxford':
+				import oxford
 				idioms = oxford.get_idioms(config.OX_URL, config.OX_LANDING_URL)
 			# Cache idiom list
 			ofn = '{0}/idiom_list_{1}_{2}.json'.format(config.WORK_DIR, dictionary_type, config.TIME)
@@ -65,6 +71,7 @@ def get_idiom_list(dictionary_type = config.DICT, case_sensitive = False):
 				idioms = json.load(f)
 		# Refine Oxford idiom list
 		if dictionary_type == 'oxford':
+			import oxford
 			idioms = oxford.refine_idioms(idioms)
 		# Lower-case everything if we ignore case
 		if not case_sensitive:
@@ -134,144 +141,329 @@ def get_idiom_list(dictionary_type = config.DICT, case_sensitive = False):
 
 	return idioms
 
+def get_matcher(idioms, case_sensitive = False, expand_pronouns = True, fuzzy = False, inflect = False):
+	'''
+	Gets the idiom matcher for string matching. Expands idioms containing
+	indefinite pronouns, generates inflectional variants, and maps them
+	back to their dictionary form. Inflectional variants are either separate
+	idioms, or, with lemma matching, sets of word forms within one idiom.
+	Caches the resulting matcher, so that it is reused for the same idiom
+	list and options.
+	'''
+
+	options = {'case_sensitive': case_sensitive, 'expand_pronouns': expand_pronouns, 'fuzzy': fuzzy, 'inflect': inflect, 'int_words': config.INT_WORDS, 'lemma_match': inflect and config.LEMMA_MATCH}
+	if inflect:
+		options['inflector'] = config.INFLECTOR
+		options['inflection_version'] = utils.get_inflection_version(config.MORPH_DIR, config.INFLECTOR)
+	cache_path = idiom_matcher.get_cache_path(config.WORK_DIR, idioms, options)
+	if os.path.isfile(cache_path) and not config.NO_CACHE:
+		return idiom_matcher.load_matcher(cache_path)
+
+	# Expand indefinite pronouns in idioms (e.g. 'someone')
+	if expand_pronouns:
+		idioms, expanded_form_map = utils.expand_indefinite_pronouns(idioms)
+
+	# Get all inflectional variants of idioms, or the word forms of the words in idioms
+	word_forms = None
+	inflection_cache_file = None
+	if inflect and not config.NO_CACHE:
+		inflection_cache_file = utils.get_inflection_cache_file(config.WORK_DIR, config.MORPH_DIR, config.INFLECTOR)
+	if inflect and config.LEMMA_MATCH:
+		idioms, word_forms, inflected_forms = utils.lemmatize_idioms(idioms, config.MORPH_DIR, num_workers = config.WORKERS, cache_file = inflection_cache_file, backend = config.INFLECTOR)
+	elif inflect:
+		idioms, inflected_form_map = utils.inflect_idioms(idioms, config.MORPH_DIR, num_workers = config.WORKERS, cache_file = inflection_cache_file, backend = config.INFLECTOR)
+
+	# Map expanded and/or inflected idioms back to base form, indexed like the idiom list
+	dictionary_forms = []
+	for idiom_idx, idiom in enumerate(idioms):
+		dictionary_form = idiom
+		if inflect and config.LEMMA_MATCH:
+			dictionary_form = inflected_forms[idiom_idx]
+		elif inflect:
+			dictionary_form = inflected_form_map[dictionary_form]
+		if expand_pronouns:
+			dictionary_form = expanded_form_map[dictionary_form]
+		dictionary_forms.append(dictionary_form)
+
+	# Generate a trie containing all idioms, and a regular expression matching all idioms
+	matcher = idiom_matcher.IdiomMatcher(idioms, dictionary_forms, int_words = config.INT_WORDS, fuzzy = fuzzy, case_sensitive = case_sensitive, word_forms = word_forms)
+	idiom_matcher.save_matcher(matcher, cache_path)
+
+	return matcher
+
+def get_sentence_offsets(sentences):
+	'''
+	Returns the character offset of each sentence in the space-joined sentences,
+	plus the total length (including a trailing space) as the last element. The 
+	offset of sentence j in a snippet starting at sentence i is offsets[j] - offsets[i].
+	'''
+
+	sentence_offsets = [0]
+	for sentence in sentences:
+		sentence_offsets.append(sentence_offsets[-1] + len(sentence) + 1)
+
+	return sentence_offsets
+
+def match_sentences(matcher, tokenizer, sentences, first_idx, last_idx):
+	'''
+	Extracts idioms from sentences[first_idx:last_idx] by string matching.
+	Sentences outside of that range are only used as context. Returns the
+	extracted idioms and matching statistics: the number of sentences skipped
+	by the prefilter, matching time, and intervening word statistics.
+	'''
+
+	extracted_idioms = [] # List of dicts, format: {'snippet': "", 'idiom': "", 'start': 0, 'end': 0, 'bnc_doc_id': "", 'bnc_sent': "", 'bnc_char_start': 0, 'bnc_char_end': 0}
+
+	# Get sentence strings from BNC data
+	if config.CORPUS_TYPE[0:3] == 'bnc':
+		sentences_with_metadata = sentences
+		sentences = [sentence_with_metadata['sentence'] for sentence_with_metadata in sentences_with_metadata]
+	# Get character offsets of sentences for multi-sentence context
+	if config.CONTEXT_TYPE == 's' and config.CONTEXT_NUMBER > 0:
+		sentence_offsets = get_sentence_offsets(sentences)
+	# Cycle through sentences, find idioms
+	stats = Counter() # Format: {'skipped_sentences': 0, 'match_time': 0., 'matches': 0, 'gap_matches': 0, 'intervening_words': 0, 'gap_time': 0.}
+	sentence_matches = [] # Format: (idx, [(dictionary_form, match)])
+	for idx in range(first_idx, last_idx):
+		sentence = sentences[idx]
+		# Skip sentences without idiom anchors
+		if not matcher.may_contain_idiom(sentence):
+			stats['skipped_sentences'] += 1
+			continue
+		time_0 = time.time()
+		matches = list(matcher.finditer(sentence, engine = config.ENGINE))
+		stats['match_time'] += time.time() - time_0
+		if matches:
+			sentence_matches.append((idx, matches))
+	stats.update(matcher.pop_stats())
+
+	# Tokenize all sentences containing idioms in one batch, tokens are only needed for n-word context
+	if config.CONTEXT_TYPE == 'w':
+		tokenized_sentences = utils.tokenize_batch(tokenizer, [sentences[idx] for idx, matches in sentence_matches])
+	for sentence_match_idx, (idx, matches) in enumerate(sentence_matches):
+		sentence = sentences[idx]
+		if config.CONTEXT_TYPE == 'w':
+			tokenized_sentence = tokenized_sentences[sentence_match_idx]
+			token_starts = [token.idx for token in tokenized_sentence]
+			token_ends = [token.idx + len(token.text) for token in tokenized_sentence]
+		for dictionary_form, match in matches:
+			# Get BNC metadata/set dummy values
+			if config.CORPUS_TYPE[0:3] == 'bnc':
+				bnc_document_id = sentences_with_metadata[idx]['document_id']
+				bnc_sentence = sentences_with_metadata[idx]['sentence_number']
+				bnc_char_start = match.start()
+				bnc_char_end = match.end()
+			else:
+				bnc_document_id = '-'
+				bnc_sentence = '-'
+				bnc_char_start = 0
+				bnc_char_end = 0
+			# Get n-word context
+			if config.CONTEXT_TYPE == 'w':
+				# Get token offsets from match offsets
+				first_idiom_token_i = max(0, bisect.bisect_right(token_starts, match.start()) - 1)
+				last_idiom_token_i = bisect.bisect_left(token_ends, match.end())
+				# Get snippet
+				snippet_start = max(0, first_idiom_token_i - config.CONTEXT_NUMBER)
+				snippet_end = min(len(tokenized_sentence), last_idiom_token_i + 1 + config.CONTEXT_NUMBER)
+				snippet = tokenized_sentence[snippet_start:snippet_end].text
+				# Get idiom character offsets in snippet
+				char_offset_span = tokenized_sentence[snippet_start].idx
+				char_offset_start = match.start() - char_offset_span
+				char_offset_end = match.end() - char_offset_span
+			# Get n-sentence context
+			elif config.CONTEXT_TYPE == 's':
+				if config.CONTEXT_NUMBER == 0:
+					snippet = sentence
+					char_offset_start = match.start()
+					char_offset_end = match.end()
+				else:
+					# Get surrounding sentences to form snippet
+					first_snippet_sentence_idx = max(0, idx - config.CONTEXT_NUMBER)
+					last_snippet_sentence_idx = min(len(sentences), idx + 1 + config.CONTEXT_NUMBER)
+					snippet = ' '.join(sentences[first_snippet_sentence_idx:last_snippet_sentence_idx])
+					# Adjust offset for length of preceding sentences and joining spaces
+					char_offset_span = sentence_offsets[idx] - sentence_offsets[first_snippet_sentence_idx]
+					char_offset_start = match.start() + char_offset_span
+					char_offset_end = match.end() + char_offset_span
+					
+			extracted_idioms.append({'snippet': snippet, 'idiom': dictionary_form, 'start': char_offset_start, 
+				'end': char_offset_end, 'bnc_document_id': bnc_document_id, 'bnc_sentence': bnc_sentence, 
+				'bnc_char_start': bnc_char_start, 'bnc_char_end': bnc_char_end})
+
+	return extracted_idioms, stats
+
+def get_sentence_blocks(documents, block_size):
+	'''
+	Splits documents into blocks of sentences, yields (sentences, first_idx, last_idx)
+	tuples. Sentences include the preceding and following context sentences of the
+	block, first_idx and last_idx delimit the block itself. Documents can be lists or
+	iterators of sentences, which are read lazily through a sliding window.
+	'''
+
+	if config.CONTEXT_TYPE == 's':
+		num_context_sentences = config.CONTEXT_NUMBER
+	else:
+		num_context_sentences = 0
+	for sentences in documents:
+		sentences = iter(sentences)
+		window = [] # Preceding context, block, and following context
+		first_idx = 0
+		while True:
+			# Read sentences up to the end of the following context of the block
+			window = window + list(itertools.islice(sentences, first_idx + block_size + num_context_sentences - len(window)))
+			last_idx = min(len(window), first_idx + block_size)
+			if last_idx <= first_idx:
+				break
+			yield (window, first_idx, last_idx)
+			# Keep preceding context for the next block
+			context_start = max(0, last_idx - num_context_sentences)
+			window = window[context_start:]
+			first_idx = last_idx - context_start
+
+def init_worker(matcher, tokenizer):
+	'''Sets up a string matching worker process, with the matcher and tokenizer of the main process.'''
+
+	global worker_matcher, worker_tokenizer
+	worker_matcher = matcher
+	worker_tokenizer = tokenizer
+
+def match_block(block):
+	'''Extracts idioms from a block of sentences in a worker process.'''
+
+	return match_sentences(worker_matcher, worker_tokenizer, *block)
+
 def string_match(idioms, documents, case_sensitive = False, expand_pronouns = True, fuzzy = False, inflect = False):
 	'''
 	Extracts idioms by exact, fuzzy, or inflectional string matching.
 	Expands idioms containing indefinite pronouns and deals with idioms
 	containing em-dash wildcards. Maps all matched idioms back to their
-	dictionary form and extracts context around the idiom.	
+	dictionary form and extracts context around the idiom. Optionally,
+	divides blocks of sentences over multiple worker processes. Yields
+	extracted idioms in corpus order, as soon as they are extracted.
 	'''
 
-	# Set flags
-	if case_sensitive:
-		flags = 0
-	else:
-		flags = re.I
+	matcher = get_matcher(idioms, case_sensitive = case_sensitive, expand_pronouns = expand_pronouns, fuzzy = fuzzy, inflect = inflect)
 
-	# Inter-word separator for regex: word boundaries + optional intervening words
-	separator = r'\b\W+(?:\w+\W+){0,' + str(config.INT_WORDS) + r'}\b'
+	# Load the tokenizer once, worker processes are forked with it
+	tokenizer = None
+	if config.CONTEXT_TYPE == 'w':
+		tokenizer = utils.load_tokenizer(config.TOKENIZER)
 
-	# Expand indefinite pronouns in idioms (e.g. 'someone')
-	if expand_pronouns:
-		idioms, expanded_form_map = utils.expand_indefinite_pronouns(idioms)
+	# Do actual extraction
+	blocks = get_sentence_blocks(documents, config.BLOCK_SIZE)
+	num_sentences = 0
+	stats = Counter()
+	if config.WORKERS > 1:
+		pool = multiprocessing.Pool(config.WORKERS, init_worker, (matcher, tokenizer))
+		# Hand out a limited number of blocks at a time, to keep memory use bounded
+		while True:
+			block_batch = list(itertools.islice(blocks, config.WORKERS * 2))
+			if not block_batch:
+				break
+			for block, (block_extracted_idioms, block_stats) in itertools.izip(block_batch, pool.imap(match_block, block_batch)):
+				num_sentences += block[2] - block[1]
+				stats.update(block_stats)
+				for extracted_idiom in block_extracted_idioms:
+					yield extracted_idiom
+		pool.close()
+		pool.join()
+	else:
+		for block in blocks:
+			block_extracted_idioms, block_stats = match_sentences(matcher, tokenizer, *block)
+			num_sentences += block[2] - block[1]
+			stats.update(block_stats)
+			for extracted_idiom in block_extracted_idioms:
+				yield extracted_idiom
+
+	print 'Prefilter skipped {0} of {1} sentences'.format(stats['skipped_sentences'], num_sentences)
+	print 'Matching took {0:.2f} seconds'.format(stats['match_time'])
+	if config.ENGINE == 'trie' and config.INT_WORDS > 0:
+		print '{0} of {1} matches contain intervening words, {2} intervening words in total'.format(stats['gap_matches'], stats['matches'], stats['intervening_words'])
+		print 'Choosing intervening words took {0:.2f} seconds'.format(stats['gap_time'])
+
+def track_idioms(extracted_idioms, idiom_set):
+	'''Passes on extracted idioms, while collecting the set of extracted dictionary forms.'''
+
+	for extracted_idiom in extracted_idioms:
+		idiom_set.add(extracted_idiom['idiom'])
+		yield extracted_idiom
+
+def get_text_chunks(sentences, max_sentences, max_characters):
+	'''
+	Groups sentences into chunks of text for parsing, containing at most max_sentences
+	sentences and max_characters characters, unless a single sentence is longer than that.
+	'''
 
-	# Get all inflectional variants of idioms
-	if inflect:
-		idioms, inflected_form_map = utils.inflect_idioms(idioms, config.MORPH_DIR)
+	chunk = []
+	chunk_length = 0
+	for sentence in sentences:
+		if chunk and (len(chunk) >= max_sentences or chunk_length + len(sentence) > max_characters):
+			yield ' '.join(chunk)
+			chunk = []
+			chunk_length = 0
+		chunk.append(sentence)
+		chunk_length += len(sentence) + 1
+	if chunk:
+		yield ' '.join(chunk)
+
+def record_parses(parses, parse_cache, parser, batch_size):
+	'''
+	Passes on the parses of a document, while appending them to the parse cache in batches of
+	batch_size parses, so that only one batch is kept in memory. Ends the document in the cache.
+	'''
 
-	extracted_idioms = [] # List of dicts, format: {'snippet': "", 'idiom': "", 'start': 0, 'end': 0, 'bnc_doc_id': "", 'bnc_sent': "", 'bnc_char_start': 0, 'bnc_char_end': 0}
+	batch = []
+	for parse in parses:
+		batch.append(parse)
+		if len(batch) >= batch_size:
+			utils.dump_parsed_batch(parse_cache, parser, batch)
+			batch = []
+		yield parse
+	if batch:
+		utils.dump_parsed_batch(parse_cache, parser, batch)
+	utils.end_parsed_document(parse_cache)
+
+def get_sentence_windows(parsed_sentences, num_context_sentences):
+	'''
+	Yields (sentence_idx, parsed_sentence, preceding_texts, following_texts) for each parsed sentence,
+	with the texts of up to num_context_sentences sentences before and after it. Sentences are read
+	lazily through a sliding window, so a document is never held in memory as a whole.
+	'''
 
-	# Generate regular expression matching all idioms
-	idiom_regex = ''
-	for idiom in idioms:
-		idiom_words = idiom.split(' ')
-		# Fuzzy matching: add optional 1/2/3-character suffix to each idiom word 
-		if fuzzy:
-			idiom_words = [re.escape(iw) + '\w?' * 3 for iw in idiom_words] # Escape special chars, add fuzzy suffix, add boundaries
-		# Regular string matching
+	parsed_sentences = iter(parsed_sentences)
+	window = [] # Preceding context, current sentence, and following context, format: [(parsed_sentence, text)]
+	current_idx = 0 # Index of the current sentence in the window
+	sentence_idx = 0
+	while True:
+		# Read sentences up to the end of the following context of the current sentence
+		for parsed_sentence in itertools.islice(parsed_sentences, current_idx + num_context_sentences + 1 - len(window)):
+			window.append((parsed_sentence, parsed_sentence.text if num_context_sentences else None))
+		if current_idx >= len(window):
+			break
+		yield (sentence_idx, window[current_idx][0], [text for parsed_sentence, text in window[:current_idx]], 
+			[text for parsed_sentence, text in window[current_idx + 1:]])
+		sentence_idx += 1
+		# Keep preceding context for the next sentence
+		if current_idx < num_context_sentences:
+			current_idx += 1
 		else:
-			idiom_words = [re.escape(iw) for iw in idiom_words] # Escape special chars
-		idiom_regex = idiom_regex + r'\b' + separator.join(idiom_words) + r'\b'
-		if idiom != idioms[-1]:
-			idiom_regex += '|'
-			
-		# Replace all em-dashes by a wildcard (\w+)
-		idiom_regex = re.sub(u'\\\—', r'\w+', idiom_regex)
+			window = window[1:]
 
-	# Do actual extraction
-	tokenizer = utils.load_tokenizer()
-	for sentences in documents:
-		# Get sentence strings from BNC data
-		if config.CORPUS_TYPE[0:3] == 'bnc':
-			sentences_with_metadata = sentences
-			sentences = [sentence_with_metadata['sentence'] for sentence_with_metadata in sentences_with_metadata]
-		# Cycle through sentences in document
-		for idx, sentence in enumerate(sentences):
-			matches = re.finditer(idiom_regex, sentence, flags = flags)
-			tokenized_sentence = ''
-			for match in matches:
-				# Only tokenize once, and only when a match is found
-				if not tokenized_sentence:
-					tokenized_sentence = utils.tokenize(tokenizer, sentence)
-				# Get token offsets from match offsets
-				for token in tokenized_sentence:
-					if token.idx == match.start():
-						first_idiom_token_i = token.i
-					if token.idx + len(token.text) == match.end():
-						last_idiom_token_i = token.i
-						break
-				# Get BNC metadata/set dummy values
-				if config.CORPUS_TYPE[0:3] == 'bnc':
-					bnc_document_id = sentences_with_metadata[idx]['document_id']
-					bnc_sentence = sentences_with_metadata[idx]['sentence_number']
-					bnc_char_start = match.start()
-					bnc_char_end = match.end()
-				else:
-					bnc_document_id = '-'
-					bnc_sentence = '-'
-					bnc_char_start = 0
-					bnc_char_end = 0
-				# Get n-word context
-				if config.CONTEXT_TYPE == 'w':
-					# Get snippet
-					snippet_start = max(0, first_idiom_token_i - config.CONTEXT_NUMBER)
-					snippet_end = min(len(tokenized_sentence), last_idiom_token_i + 1 + config.CONTEXT_NUMBER)
-					snippet = tokenized_sentence[snippet_start:snippet_end].text
-					# Get idiom character offsets in snippet
-					char_offset_span = tokenized_sentence[snippet_start].idx
-					char_offset_start = match.start() - char_offset_span
-					char_offset_end = match.end() - char_offset_span
-				# Get n-sentence context
-				elif config.CONTEXT_TYPE == 's':
-					if config.CONTEXT_NUMBER == 0:
-						snippet = sentence
-						char_offset_start = match.start()
-						char_offset_end = match.end()
-					else:
-						# Get surrounding sentences to form snippet
-						first_snippet_sentence_idx = max(0, idx - config.CONTEXT_NUMBER)
-						last_snippet_sentence_idx = min(len(sentences), idx + 1 + config.CONTEXT_NUMBER)
-						snippet_sentences = sentences[first_snippet_sentence_idx:last_snippet_sentence_idx]
-						snippet = ' '.join(snippet_sentences)
-						# Adjust offset for length of preceding sentences and joining space to the current sentence
-						num_preceding_sentences = idx - first_snippet_sentence_idx
-						char_offset_span = len(' '.join(snippet_sentences[:num_preceding_sentences]))
-						char_offset_start = match.start() + char_offset_span + 1
-						char_offset_end = match.end() + char_offset_span + 1
-						
-				# Get dictionary form of idiom
-				matched_string = sentence[match.start():match.end()]
-				if not case_sensitive:
-					matched_string = matched_string.lower()
-				dictionary_form = ''
-				# Deal with em-dash wildcard idiom, and idioms matched with non-spaces
-				if matched_string not in idioms:
-					for idiom in idioms:
-						idiom_words = idiom.split(' ')
-						if fuzzy:
-							idiom_words = [re.escape(idiom_word) + '\w?' * 3 for idiom_word in idiom_words]
-						else:
-							idiom_words = [re.escape(idiom_word) for idiom_word in idiom_words]
-						single_idiom_regex = r'\b' + separator.join(idiom_words) + r'\b'
-						if u'\u2014' in idiom:
-							single_idiom_regex = re.sub(ur'\\\u2014', r'\w+', single_idiom_regex)
-						if re.match(single_idiom_regex, matched_string):
-							dictionary_form = idiom
-							break
-				# Occurs exactly in idiom list, so already is dictionary form 
-				else:
-					dictionary_form = matched_string
-				# Map expanded and/or inflected idioms back to base form
-				if inflect:
-					dictionary_form = inflected_form_map[dictionary_form]
-				if expand_pronouns:
-					dictionary_form = expanded_form_map[dictionary_form]
+# Parser of the parse method, loaded on first use by get_parser
+parser = None
 
-				extracted_idioms.append({'snippet': snippet, 'idiom': dictionary_form, 'start': char_offset_start, 
-					'end': char_offset_end, 'bnc_document_id': bnc_document_id, 'bnc_sentence': bnc_sentence, 
-					'bnc_char_start': bnc_char_start, 'bnc_char_end': bnc_char_end})
+def get_parser():
+	'''
+	Loads the parser on first use, so that it is not loaded at all when idiom patterns
+	and corpus parses all come from caches. Starting Stanford CoreNLP servers is expensive.
+	'''
 
-	return extracted_idioms
+	global parser
+	if parser is None:
+		parser = utils.load_parser(config.PARSER, config.STANFORD_SERVERS, config.STANFORD_URLS)
+
+	return parser
 
 def parse_extract(idioms, sentences):
 	'''
@@ -282,161 +474,140 @@ def parse_extract(idioms, sentences):
 	with idioms containing indefinite pronouns and em-dashes properly.
 	'''
 
-	parser = utils.load_parser(config.PARSER)
 	extracted_idioms = [] # List of dicts, format: {'snippet': "", 'idiom': "", 'start': 0, 'end': 0, 'bnc_doc_id': "", 'bnc_sent': "", 'bnc_char_start': 0, 'bnc_char_end': 0}
 	# Use a PoS-ambiguous word to parse idioms containing em-dash wildcards
 	ambiguous_word = 'fine'
 
-	# Parse idioms in context
+	# Use idiom patterns cached by an earlier run with the same idioms, parser and example sentences
+	sentences_source = None
 	if config.SENTENCES:
-		cache_file = '{0}/example_sentences_{1}_{2}_{3}.json'.format(config.WORK_DIR, '_'.join(config.DICT), config.SENTENCES.split('/')[-1][:-4], config.TIME)
-		idioms_with_sentences = utils.get_example_sentences(idioms, config.SENTENCES, cache_file)
-		parsed_idioms = utils.parse_example_sentences(idioms_with_sentences, ambiguous_word, parser)
-	# Parse idioms without context
+		sentences_stat = os.stat(config.SENTENCES)
+		sentences_source = [config.SENTENCES, sentences_stat.st_size, int(sentences_stat.st_mtime)]
+	options = {'dictionary': config.DICT, 'parser': config.PARSER, 'parser_version': utils.get_parser_version(config.PARSER),
+		'sentences': sentences_source, 'ambiguous_word': ambiguous_word}
+	cache_path = idiom_pattern.get_cache_path(config.WORK_DIR, idioms, options)
+	if os.path.isfile(cache_path) and not config.NO_CACHE:
+		idiom_patterns = idiom_pattern.load_patterns(cache_path, config.NO_LABELS, config.NO_DIRECTION)
 	else:
-		parsed_idioms = []
-		for idiom in idioms:
-			parsed_idioms.append(utils.parse_idiom(idiom, ambiguous_word, parser))
+		# Parse idioms in context
+		if config.SENTENCES:
+			cache_file = '{0}/example_sentences_{1}_{2}_{3}.json'.format(config.WORK_DIR, '_'.join(config.DICT), config.SENTENCES.split('/')[-1][:-4], config.TIME)
+			idioms_with_sentences = utils.get_example_sentences(idioms, config.SENTENCES, cache_file)
+			parsed_idioms = utils.parse_example_sentences(idioms_with_sentences, ambiguous_word, get_parser())
+		# Parse idioms without context
+		else:
+			parsed_idioms = []
+			for idiom in idioms:
+				parsed_idioms.append(utils.parse_idiom(idiom, ambiguous_word, get_parser()))
+
+		# Compile idiom parse trees into patterns
+		idiom_patterns = []
+		for parsed_idiom in parsed_idioms:
+			idiom_subtree = parsed_idiom[2]
+			# If not parsed in context, there is no stored list, so get generator
+			if not idiom_subtree: 
+				idiom_subtree = parsed_idiom[1].subtree
+			# Use list, rather than generator
+			idiom_subtree = [x for x in idiom_subtree]
+			idiom_patterns.append(idiom_pattern.IdiomPattern(parsed_idiom, idiom_subtree, ambiguous_word, config.NO_LABELS, config.NO_DIRECTION))
+		if not config.NO_CACHE:
+			idiom_pattern.save_patterns(idiom_patterns, cache_path)
+
+	# Index idioms by the lemma of their top token, which has to occur in a sentence to match the idiom
+	# Without directionality, any idiom token can be the top token, so index idioms by all their lemmata
+	# Idioms with an em-dash as top token are matched by a different heuristic, so always consider those
+	idiom_lemma_index = {} # Format: {lemma: [idiom_idx]}
+	unindexed_idiom_indices = []
+	for idiom_idx, pattern in enumerate(idiom_patterns):
+		if pattern.em_dash_top:
+			unindexed_idiom_indices.append(idiom_idx)
+		idiom_lemmata = set([pattern.top_lemma])
+		if config.NO_DIRECTION:
+			idiom_lemmata.update(pattern.subtree_lemmata)
+		for idiom_lemma in idiom_lemmata:
+			idiom_lemma_index.setdefault(idiom_lemma, []).append(idiom_idx)
+
+	# Use parses cached by an earlier run on the same corpus with the same parser, or cache the parses of this run
+	parse_cache_file = utils.get_parse_cache_file(config.WORK_DIR, config.CORPUS, config.CORPUS_TYPE, config.PARSER, config.NO_SPLIT)
+	cached_documents = None
+	parse_cache = None
+	if not config.NO_CACHE:
+		if os.path.isfile(parse_cache_file):
+			print 'Using cached parses from {0}'.format(parse_cache_file)
+			# Cached Spacy parses need the vocabulary of the model, cached Stanford parses need no servers
+			if config.PARSER == 'spacy':
+				cached_documents = utils.load_parsed_documents(parse_cache_file, get_parser())
+			else:
+				cached_documents = utils.load_parsed_documents(parse_cache_file, (config.PARSER, None))
+		else:
+			# Write to temporary file, so that an interrupted run does not leave an incomplete cache
+			parse_cache = open(parse_cache_file + '.tmp', 'wb')
 
 	# Extract idiom instances by matching parse trees
 	for sentences in documents:
 		time_0 = time.time()
-		print 'Parsing document...'
-		# Get sentence strings from BNC data and parse
+		print 'Parsing and matching document...'
+		# Get sentence strings from BNC data
 		if config.CORPUS_TYPE [0:3]== 'bnc':
 			sentences_with_metadata = sentences
 			sentences = [sentence_with_metadata['sentence'] for sentence_with_metadata in sentences_with_metadata]
-			# Parse sentence, and turn resulting Doc into Span object
-			parsed_sentences = [utils.parse(parser, sentence)[:] for sentence in sentences]
-		# Parse corpus as a whole, let Spacy do the sentence splitting
+		# Get parses from cache
+		if cached_documents is not None:
+			parses = next(cached_documents)
+		# Parse BNC sentences in batches
+		# Parses come in the same order as the sentences, so they stream into the matcher with their metadata index
+		elif config.CORPUS_TYPE [0:3]== 'bnc':
+			parse_batch_size = config.PARSE_BATCH_SIZE
+			parses = utils.parse_batch(get_parser(), sentences, parse_batch_size, config.WORKERS)
+		# Parse plain text in chunks of whole sentences, let Spacy do the sentence splitting within chunks
+		# Batches contain about as many sentences as batches of BNC sentences
+		else:
+			chunks = get_text_chunks(sentences, config.CHUNK_SENTENCES, config.CHUNK_CHARACTERS)
+			parse_batch_size = max(1, config.PARSE_BATCH_SIZE / config.CHUNK_SENTENCES)
+			parses = utils.parse_batch(get_parser(), chunks, parse_batch_size, config.WORKERS)
+		# Cache new parses batch by batch, while they are being matched
+		if parse_cache:
+			parses = record_parses(parses, parse_cache, get_parser(), parse_batch_size)
+		# Turn BNC sentence Docs into Span objects, split chunks into sentences, numbered across the whole document
+		if config.CORPUS_TYPE [0:3]== 'bnc':
+			parsed_sentences = (parse[:] for parse in parses)
 		else:
-			parsed_corpus = utils.parse(parser, ' '.join(sentences))
-			parsed_sentences = parsed_corpus.sents
+			parsed_sentences = (parsed_sentence for parse in parses for parsed_sentence in parse.sents)
 
-		print 'Done! Parsing document took {0:.2f} seconds'.format(time.time() - time_0)
 		# Cycle through sentences, attempt to match parse trees
-		for sentence_idx, parsed_sentence in enumerate(parsed_sentences):
-			for parsed_idiom in parsed_idioms:
-
-				# Get idiom information
-				idiom_top_lemma = parsed_idiom[0]
-				idiom_top_token = parsed_idiom[1]
-				idiom_subtree = parsed_idiom[2]
-				# If not parsed in context, there is no stored list, so get generator
-				if not idiom_subtree: 
-					idiom_subtree = idiom_top_token.subtree
-				# Use list, rather than generator
-				idiom_subtree = [x for x in idiom_subtree]
-				has_em_dash = parsed_idiom[3]
+		# Multi-sentence context comes from a sliding window of sentence texts
+		if config.CONTEXT_TYPE == 's':
+			num_context_sentences = config.CONTEXT_NUMBER
+		else:
+			num_context_sentences = 0
+		for sentence_idx, parsed_sentence, preceding_texts, following_texts in get_sentence_windows(parsed_sentences, num_context_sentences):
+			# Only consider idioms whose top lemma (or any lemma, without directionality) occurs in the sentence
+			candidate_idiom_indices = set(unindexed_idiom_indices)
+			sentence_lemmata = set()
+			for sentence_token in parsed_sentence:
+				sentence_lemmata.add(sentence_token.lemma_)
+				if sentence_token.lemma_ in idiom_lemma_index:
+					candidate_idiom_indices.update(idiom_lemma_index[sentence_token.lemma_])
+			for idiom_idx in sorted(candidate_idiom_indices):
+				pattern = idiom_patterns[idiom_idx]
 				# Save previously matched indices to check for overlapping spans
 				previously_matched_indices = [] 
 
 				# When idiom top lemma is em-dash, check if other lemma-tokens occur in sentence, only then try matching the parse trees
-				consider_this_em_dash_idiom = False
-				if has_em_dash and idiom_top_lemma == ambiguous_word:
-					idiom_content_tokens = [token for token in idiom_subtree if token.tag_ not in ['DT'] and token != idiom_top_token]
-					sentence_lemmata = [token.lemma_ for token in parsed_sentence]
-					if all([idiom_content_token.lemma_ in sentence_lemmata for idiom_content_token in idiom_content_tokens]):
-						consider_this_em_dash_idiom = True
+				consider_this_em_dash_idiom = pattern.matches_em_dash_heuristic(sentence_lemmata)
 
 				# Cycle through sentence parse, match top lemma to sentence lemma and idiom parse tree to sentence parse tree
 				for sentence_token in parsed_sentence:
 					# Match top lemma or em-dash heuristic or match any idiom token as possible top token in case of no directionality
-					if sentence_token.lemma_ == idiom_top_token.lemma_ or consider_this_em_dash_idiom or (config.NO_DIRECTION and sentence_token.lemma_ in [x.lemma_ for x in idiom_subtree]):
-						sentence_top_token = sentence_token
-						# Keep track of indices of matching tokens for later span extraction
-						matched_indices = [sentence_top_token.i] 
-						# Match parse trees, account for many special cases
-						for idiom_subtree_token in idiom_subtree:
-							# Skip top token and articles
-							if idiom_subtree_token != idiom_top_token and idiom_subtree_token.lower_ not in ['a', 'the', 'an']:
-								matched_subtree_token = False
-								for sentence_subtree_token in sentence_token.subtree:
-									# Match condition components
-									# Spacy gives same lemma for all pronouns, so match on lower-cased form 
-									matching_lemma = (idiom_subtree_token.lemma_ == sentence_subtree_token.lemma_ and idiom_subtree_token.lemma_ != u'-PRON-') or (idiom_subtree_token.lemma_ == u'-PRON-' and idiom_subtree_token.lower_ == sentence_subtree_token.lower_)
-									# Optionally, ignore dependency labels
-									matching_dep = idiom_subtree_token.dep_ == sentence_subtree_token.dep_ or config.NO_LABELS
-									matching_head_lemma = (idiom_subtree_token.head.lemma_ == sentence_subtree_token.head.lemma_ and idiom_subtree_token.head.lemma_ != u'-PRON-') or (idiom_subtree_token.head.lemma_ == u'-PRON-' and idiom_subtree_token.head.lower_ == sentence_subtree_token.head.lower_)
-									# Optionally, allow for direction reversal
-									if config.NO_DIRECTION:
-										if idiom_subtree_token.head.lemma_ == u'-PRON-':
-											matched_children = [x for x in sentence_subtree_token.children if x.lower_ == idiom_subtree_token.head.lower_]
-										else:
-											matched_children = [x for x in sentence_subtree_token.children if x.lemma_ == idiom_subtree_token.head.lemma_]
-										matching_child_lemma = matched_children != []
-										matching_head_lemma = matching_head_lemma or matching_child_lemma
-									em_dash_lemma = has_em_dash and idiom_subtree_token.lemma_ == ambiguous_word
-									em_dash_head_lemma = has_em_dash and idiom_subtree_token.head.lemma_ == ambiguous_word
-									inverted_dep = idiom_subtree_token.dep_ == 'dobj' and sentence_subtree_token.dep_ == 'nsubjpass' or config.NO_LABELS
-									# Default case: lemma, dep-rel and head lemma have to match.
-									# In case of em-dash, match lemma or head lemma, and the other one to the ambiguous word
-									if (matching_lemma and matching_dep and matching_head_lemma or 
-											em_dash_lemma and matching_head_lemma or 
-											matching_lemma and em_dash_head_lemma):
-										matched_subtree_token = True
-									# Passivization: match lemma, head lemma and inverted dep-rels
-									elif matching_lemma and inverted_dep and matching_head_lemma:
-										matched_subtree_token = True
-									# Deal with someone and someone's
-									elif idiom_subtree_token.lemma_ == 'someone':
-										idiom_right_children = [right for right in idiom_subtree_token.rights]
-										# Deal with someone's - match any other PRP$ or NN(P)(S) + POS for lemma
-										if idiom_right_children and idiom_right_children[0].lemma_ == "'s":
-											sentence_right_children = [right for right in sentence_subtree_token.rights]
-											if (matching_dep and matching_head_lemma and (sentence_subtree_token.tag_ == 'PRP$' or
-													sentence_subtree_token.tag_ in ['NN', 'NNS', 'NNP', 'NNPS'] and 
-													sentence_right_children and sentence_right_children[0].lemma_ == "'s")):
-												matched_subtree_token = True
-										# Deal with someone - match any other PRP or NN(P)(S) for lemma
-										else:
-											if ((matching_dep or inverted_dep) and matching_head_lemma and 
-													sentence_subtree_token.tag_ in ['PRP', 'NN', 'NNS', 'NNP', 'NNPS']):
-												matched_subtree_token = True
-									# Deal with one's - match any PRP$ for lemma
-									elif idiom_subtree_token.lemma_ == 'one':
-										idiom_right_children = [right for right in idiom_subtree_token.rights]
-										if idiom_right_children and idiom_right_children[0].lemma_ == "'s":
-											if matching_dep and matching_head_lemma and sentence_subtree_token.tag_ == 'PRP$':
-												matched_subtree_token = True
-									# Deal with something and something's
-									elif idiom_subtree_token.lemma_ == 'something':
-										idiom_right_children = [right for right in idiom_subtree_token.rights]
-										# Deal with something's - match any other PRP$ or NN(P)(S) + POS for lemma
-										if idiom_right_children and idiom_right_children[0].lemma_ == "'s":
-											sentence_right_children = [right for right in sentence_subtree_token.rights]
-											if (matching_dep and matching_head_lemma and (sentence_subtree_token.tag_ == 'PRP$' or 
-													sentence_subtree_token.tag_ in ['NN', 'NNS', 'NNP', 'NNPS'] and 
-													sentence_right_children and sentence_right_children[0].lemma_ == "'s")):
-												matched_subtree_token = True
-										# Deal with something - match any other PRP or NN(P)(S) or this/that/these/those for lemma
-										else:
-											if ((matching_dep or inverted_dep) and matching_head_lemma and 
-													(sentence_subtree_token.tag_ in ['PRP', 'NN', 'NNS', 'NNP', 'NNPS'] or 
-													sentence_subtree_token.lemma_ in ['this', 'that', 'these', 'those'])):
-												matched_subtree_token = True
-									# Deal with 's of someone's, one's and something's by ignoring it
-									elif idiom_subtree_token.lemma_ == "'s" and idiom_subtree_token.head.lemma_ in ['someone', 'one', 'something']:
-										matched_subtree_token = True
-										break
-
-									if matched_subtree_token: # Match, go to next idiom subtree token
-										# Add child in case of no-directionality child match
-										if config.NO_DIRECTION and matching_child_lemma:
-											matched_indices.append(matched_children[0].i)
-										else:
-											matched_indices.append(sentence_subtree_token.i)
-										break
-								if not matched_subtree_token: # No match, go to next sentence token
-									break
+					if consider_this_em_dash_idiom or pattern.is_top_candidate(sentence_token):
+						matched, matched_indices = pattern.match(sentence_token)
+						# Idioms without tokens besides the top token and articles keep the outcome of the previous match
+						if matched is not None:
+							matched_subtree_token = matched
 
 						# If everything matches, extract snippet
 						if matched_subtree_token:
-							# Text of idiom subtree is dictionary form
-							dictionary_form = ''.join([idiom_subtree_token.text_with_ws for idiom_subtree_token in idiom_subtree]).strip()
-							# Deal with em-dash wildcard idiom, substitute em-dash back in for ambiguous word
-							if has_em_dash:
-								dictionary_form = re.sub(ambiguous_word, u'\u2014', dictionary_form)
+							dictionary_form = pattern.dictionary_form
 							# Get idiom token span
 							first_idiom_token_i = min(matched_indices) - parsed_sentence.start
 							last_idiom_token_i = max(matched_indices) - parsed_sentence.start
@@ -456,20 +627,10 @@ def parse_extract(idioms, sentences):
 									# Store character offset of sentence (==snippet) start
 									char_offset_span = parsed_sentence.start_char
 								else:
-									snippet = ""
 									# Get snippet sentences
-									first_sentence_idx = sentence_idx - config.CONTEXT_NUMBER
-									last_sentence_idx = sentence_idx + config.CONTEXT_NUMBER
-									# Re-iterate over sentences to extract the sentence contents
-									for sentence_idx_2, parsed_sentence_2 in enumerate(parsed_corpus.sents):
-										if sentence_idx_2 >= first_sentence_idx and sentence_idx_2 <= last_sentence_idx:
-											# Store character offset of snippet start
-											if sentence_idx_2 == first_sentence_idx:
-												char_offset_span = parsed_sentence_2.start_char
-											# Add space between sentences
-											if snippet: 
-												snippet += ' ' 
-											snippet += parsed_sentence_2.text
+									snippet = ' '.join(preceding_texts + [parsed_sentence.text] + following_texts)
+									# Store character offset of snippet start, relative to the current sentence
+									char_offset_span = parsed_sentence.start_char - sum([len(text) + 1 for text in preceding_texts])
 							# Get idiom character offsets in snippet
 							char_offset_start = first_idiom_token.idx - char_offset_span
 							char_offset_end = last_idiom_token.idx + len(last_idiom_token.text) - char_offset_span
@@ -492,19 +653,28 @@ def parse_extract(idioms, sentences):
 							# Check whether the instance has already been added, with a larger span (this can happen with em-dash idioms). Don't do this for NLD matches.
 							if previously_matched_indices:
 								# Remove most recent entry if it has a larger span than the current entry 
-								if min(previously_matched_indices) <= min(matched_indices) and max(previously_matched_indices) >= max(matched_indices) and (sentence_token.lemma_ == idiom_top_token.lemma_ or consider_this_em_dash_idiom):
+								if min(previously_matched_indices) <= min(matched_indices) and max(previously_matched_indices) >= max(matched_indices) and (sentence_token.lemma_ == pattern.top_lemma or consider_this_em_dash_idiom):
 									del extracted_idioms[-1]
 								# Only add current entry if it doesn't have a larger span than the most recent entry
-								if not (min(previously_matched_indices) >= min(matched_indices) and max(previously_matched_indices) <= max(matched_indices)) and (sentence_token.lemma_ == idiom_top_token.lemma_ or consider_this_em_dash_idiom):
+								if not (min(previously_matched_indices) >= min(matched_indices) and max(previously_matched_indices) <= max(matched_indices)) and (sentence_token.lemma_ == pattern.top_lemma or consider_this_em_dash_idiom):
 									extracted_idioms.append(extracted_idiom)
 									previously_matched_indices = matched_indices
 							else:
 								extracted_idioms.append(extracted_idiom)
 								previously_matched_indices = matched_indices
 
+		print 'Done! Parsing and matching document took {0:.2f} seconds'.format(time.time() - time_0)
+
+	if parse_cache:
+		parse_cache.close()
+		os.rename(parse_cache_file + '.tmp', parse_cache_file)
+		print 'Caching parses in {0}'.format(parse_cache_file)
+
 	return extracted_idioms
 
 if __name__ == '__main__':
+	# Parse command-line arguments, the resulting configuration is used by all functions above
+	config = config.parse_args()
 	print 'Hello! Time is {0}'.format(config.TIME)
 
 	# Create working directory if it doesn't exist
@@ -513,8 +683,9 @@ if __name__ == '__main__':
 
 	# Read in corpus as list of documents
 	if config.CORPUS_TYPE == 'plain':
-		documents = process_corpus.plain_text(config.CORPUS, config.NO_SPLIT)
-		print 'First sentence of corpus: {0}\nLast sentence of corpus: {1}'.format(u8(documents[0][0]), u8(documents[-1][-1]))
+		# Read sentences lazily from a single document
+		documents = [process_corpus.iter_plain_text(config.CORPUS, config.NO_SPLIT)]
+		print 'Streaming sentences from {0}'.format(config.CORPUS)
 	elif config.CORPUS_TYPE[0:3] == 'bnc':
 		cache_path = os.path.join(config.WORK_DIR, '{0}_parsed_xml.json'.format(config.CORPUS_TYPE))
 		documents = process_corpus.bnc(config.CORPUS, config.CORPUS_TYPE, cache_path)
@@ -535,12 +706,12 @@ if __name__ == '__main__':
 	elif config.METHOD == 'parse':
 		extracted_idioms = parse_extract(idioms, documents)
 
+	# Output extracted idioms to file, string matching methods output them while extracting
+	idiom_set = set()
+	num_extracted_idioms = utils.write_csv(track_idioms(extracted_idioms, idiom_set), config.OUTFILE)
+
 	# Print information about extracted idioms
-	print 'Extracted {0} idioms in {1:.2f} seconds'.format(len(extracted_idioms), time.time() - extraction_start)
-	idiom_set = set([extracted_idiom['idiom'] for extracted_idiom in extracted_idioms])
+	print 'Extracted {0} idioms in {1:.2f} seconds'.format(num_extracted_idioms, time.time() - extraction_start)
 	if len(idiom_set) >= 5:
 		idiom_sample = random.sample(idiom_set, 5)
 		print 'Extracted these idioms, among others: {0}, {1}, {2}, {3}, {4}'.format(u8(idiom_sample[0]), u8(idiom_sample[1]), u8(idiom_sample[2]), u8(idiom_sample[3]), u8(idiom_sample[4]))
-
-	# Output extracted idioms to file 
-	utils.write_csv(extracted_idioms, config.OUTFILE)
@@ -0,0 +1,604 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Build matchers for the string-matching extraction methods: idiom regexes and a token-level idiom trie.'''
+
+import re, bisect, hashlib, json, os, time
+from collections import Counter
+import cPickle as pickle
+
+# Version of the cached matcher format, change to invalidate existing caches
+CACHE_VERSION = 6
+
+# Numbers of counted sentences after which idiom anchors are reselected
+ANCHOR_UPDATES = [1000, 10000, 100000]
+
+# Kinds of idiom tokens stored in the trie
+LITERAL = 0
+FUZZY = 1
+WILDCARD = 2
+LEMMA = 3
+
+# Runs of word characters in sentences, and runs of word characters and em-dash wildcards in idioms
+WORD_REGEX = re.compile(r'\w+')
+IDIOM_WORD_REGEX = re.compile(u'[\\w—]+')
+
+def get_separator(int_words):
+	'''Inter-word separator for regex: word boundaries + optional intervening words'''
+
+	return r'\b\W+(?:\w+\W+){0,' + str(int_words) + r'}\b'
+
+def idiom_to_regex(idiom, separator, fuzzy = False, word_forms = None):
+	'''
+	Turns a single idiom into a regular expression, with em-dash wildcards and optional fuzzy suffixes.
+	Optionally, takes a list of alternative word forms for each word (None for words without alternatives).
+	'''
+
+	idiom_words = idiom.split(' ')
+	# Fuzzy matching: add optional 1/2/3-character suffix to each idiom word
+	if fuzzy:
+		idiom_words = [re.escape(idiom_word) + '\w?' * 3 for idiom_word in idiom_words]
+	# Regular string matching
+	else:
+		idiom_words = [re.escape(idiom_word) for idiom_word in idiom_words]
+	# Match any of the word forms of a word
+	if word_forms:
+		for word_idx, forms in enumerate(word_forms):
+			if forms:
+				idiom_words[word_idx] = '(?:' + '|'.join([re.escape(form) for form in forms]) + ')'
+	idiom_regex = r'\b' + separator.join(idiom_words) + r'\b'
+	# Replace all em-dashes by a wildcard (\w+)
+	idiom_regex = re.sub(u'\\\\—', r'\w+', idiom_regex)
+
+	return idiom_regex
+
+class WordMatch:
+	'''Match of an idiom found by the trie, with the same interface as a regex match object.'''
+
+	def __init__(self, string, start, end):
+		self.string = string
+		self._start = start
+		self._end = end
+
+	def start(self):
+		return self._start
+
+	def end(self):
+		return self._end
+
+	def span(self):
+		return self._start, self._end
+
+	def group(self):
+		return self.string[self._start:self._end]
+
+class IdiomTrie:
+	'''
+	Trie of idioms over word tokens, for finding all idioms in a sentence in
+	one pass over its words. Idiom tokens are literal words, fuzzy words
+	(which may have a suffix of up to three characters), em-dash wildcards
+	(any word), or lemmata (any of a set of word forms). The trie proposes candidate idioms at each word, tracking the
+	set of sentence positions reached at each trie node, so that intervening
+	words take time linear in the number of allowed intervening words, rather
+	than exponential. Idioms consisting of plain words are matched by the trie
+	alone, other idioms are confirmed by the regex of that single idiom. Either
+	way, the matches are the same as those of the alternation of all idiom 
+	regexes. The trie also serves as a table to find out which idiom the 
+	alternation matched.
+	'''
+
+	def __init__(self, idioms, int_words = 0, fuzzy = False, case_sensitive = False, word_forms = None):
+		self.idioms = idioms
+		self.word_forms = word_forms # Word forms of lemmata in idioms, indexed like idioms, format: [[('form', ...) or None]] or None
+		self.int_words = int_words
+		self.fuzzy = fuzzy
+		self.case_sensitive = case_sensitive
+		self.separator = get_separator(int_words)
+		if case_sensitive:
+			self.flags = 0
+		else:
+			self.flags = re.I
+		self.root = {} # Nested dicts, format: {(gap_allowed, kind, text): child_node, None: [(idiom_idx, lead_length)]}
+		self.patterns = {} # Single-idiom regexes, compiled on first use
+		self.unindexed = [] # Indices of idioms which cannot be stored in the trie
+		self.plain = {} # Trie tokens of idioms which the trie matches without regex, format: {idiom_idx: tokens}
+		self.lemmata = {} # Lemma tokens by word form, format: {'form': set([('form', ...)])}
+		self.max_lead_length = 0
+		self.stats = Counter() # Intervening word statistics, format: {'matches': 0, 'gap_matches': 0, 'intervening_words': 0, 'gap_time': 0.}
+		for idiom_idx, idiom in enumerate(idioms):
+			self.add(idiom_idx, idiom)
+
+	# Don't pickle compiled regexes, unpickling recompiles them, which is slower than compiling them on demand
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state['patterns'] = {}
+		state['stats'] = Counter()
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+
+	def get_tokens(self, idiom, word_forms = None):
+		'''
+		Turns an idiom into a list of trie tokens, and the length of any
+		punctuation preceding the first word. Stops at words which start
+		or end with punctuation, since anything after that is left to the
+		confirming regex. Words with alternative word forms become lemma 
+		tokens, of which the text is the tuple of word forms.
+		'''
+
+		tokens = [] # Format: (gap_allowed, kind, text)
+		lead_length = 0
+		for word_idx, idiom_word in enumerate(idiom.split(' ')):
+			if word_forms and word_forms[word_idx]:
+				forms = word_forms[word_idx]
+				if not self.case_sensitive:
+					forms = [form.lower() for form in forms]
+				# Lemma tokens only for forms consisting of a single run of word characters
+				if not all([WORD_REGEX.match(form) and WORD_REGEX.match(form).end() == len(form) for form in forms]):
+					break
+				tokens.append((word_idx > 0, LEMMA, tuple(sorted(set(forms)))))
+				continue
+			runs = list(IDIOM_WORD_REGEX.finditer(idiom_word))
+			if not runs:
+				break
+			if runs[0].start() > 0:
+				if word_idx == 0:
+					lead_length = runs[0].start()
+				else:
+					break
+			for run_idx, run in enumerate(runs):
+				text = run.group()
+				if u'—' in text:
+					kind = WILDCARD
+					text = None
+				elif self.fuzzy and run_idx == len(runs) - 1 and run.end() == len(idiom_word):
+					kind = FUZZY
+				else:
+					kind = LITERAL
+				if text and not self.case_sensitive:
+					text = text.lower()
+				# Intervening words are only allowed before the first token of an idiom word
+				tokens.append((word_idx > 0 and run_idx == 0, kind, text))
+			if runs[-1].end() < len(idiom_word):
+				break
+
+		return tokens, lead_length
+
+	def get_idiom_forms(self, idiom_idx):
+		'''Gets the word forms of the lemmata in an idiom, if any.'''
+
+		if self.word_forms:
+			return self.word_forms[idiom_idx]
+
+	def add(self, idiom_idx, idiom):
+		'''Adds an idiom to the trie. Idioms without any word characters are kept apart and matched by regex.'''
+
+		tokens, lead_length = self.get_tokens(idiom, self.get_idiom_forms(idiom_idx))
+		if not tokens:
+			self.unindexed.append(idiom_idx)
+			return
+		self.max_lead_length = max(self.max_lead_length, lead_length)
+		node = self.root
+		for token in tokens:
+			node = node.setdefault(token, {})
+			if token[1] == LEMMA:
+				for form in token[2]:
+					self.lemmata.setdefault(form, set()).add(token[2])
+		node.setdefault(None, []).append((idiom_idx, lead_length))
+		if self.is_plain(idiom, tokens, lead_length):
+			self.plain[idiom_idx] = tokens
+
+	def is_plain(self, idiom, tokens, lead_length):
+		'''
+		Checks whether the trie tokens of an idiom describe its regex exactly: each
+		idiom word should be a single run of word characters, or an em-dash wildcard.
+		'''
+
+		idiom_words = idiom.split(' ')
+		if lead_length > 0 or len(tokens) != len(idiom_words):
+			return False
+		for idiom_word, (gap_allowed, kind, text) in zip(idiom_words, tokens):
+			if kind == WILDCARD:
+				if idiom_word != u'—':
+					return False
+			elif kind == LEMMA:
+				continue
+			elif not WORD_REGEX.match(idiom_word) or WORD_REGEX.match(idiom_word).end() != len(idiom_word):
+				return False
+
+		return True
+
+	def get_pattern(self, idiom_idx):
+		'''Gets compiled regex of a single idiom.'''
+
+		if idiom_idx not in self.patterns:
+			self.patterns[idiom_idx] = re.compile(idiom_to_regex(self.idioms[idiom_idx], self.separator, self.fuzzy, self.get_idiom_forms(idiom_idx)), self.flags)
+
+		return self.patterns[idiom_idx]
+
+	def get_keys(self, gap_allowed, text):
+		'''Gets all trie keys which can match a sentence word.'''
+
+		keys = [(gap_allowed, LITERAL, text), (gap_allowed, WILDCARD, None)]
+		if text in self.lemmata:
+			keys += [(gap_allowed, LEMMA, forms) for forms in self.lemmata[text]]
+		if self.fuzzy:
+			for suffix_length in range(4):
+				if len(text) > suffix_length:
+					keys.append((gap_allowed, FUZZY, text[:len(text) - suffix_length]))
+
+		return keys
+
+	def matches_token(self, token, text):
+		'''Checks whether a sentence word matches a trie token.'''
+
+		gap_allowed, kind, token_text = token
+		if kind == WILDCARD:
+			return True
+		elif kind == FUZZY:
+			return text.startswith(token_text) and len(text) - len(token_text) <= 3
+		elif kind == LEMMA:
+			return text in token_text
+		else:
+			return text == token_text
+
+	def get_window(self, gap_allowed, word_idx, num_words):
+		'''Gets the indices of the sentence words which can match a token, allowing for intervening words.'''
+
+		if gap_allowed:
+			return range(word_idx, min(num_words, word_idx + self.int_words + 1))
+		else:
+			return range(word_idx, min(num_words, word_idx + 1))
+
+	def lookup(self, words, first_word_idx):
+		'''
+		Walks the trie from a sentence word, returns (idiom_idx, lead_length) for all
+		idioms found, and the positions reached. Rather than following each way to 
+		skip intervening words separately, keeps track of the set of positions (index
+		of the next sentence word) reached at each trie node, format: {id(node): set}.
+		'''
+
+		found = []
+		positions = {id(self.root): set([first_word_idx])}
+		nodes = [self.root]
+		while nodes:
+			next_nodes = []
+			for node in nodes:
+				if None in node:
+					found += node[None]
+				for gap_allowed in [False, True]:
+					# Union of the windows of all positions, each word is looked up once
+					word_indices = set()
+					for word_idx in positions[id(node)]:
+						word_indices.update(self.get_window(gap_allowed, word_idx, len(words)))
+					for word_idx in word_indices:
+						for key in self.get_keys(gap_allowed, words[word_idx][1]):
+							if key in node:
+								child = node[key]
+								if id(child) not in positions:
+									positions[id(child)] = set()
+									next_nodes.append(child)
+								positions[id(child)].add(word_idx + 1)
+			nodes = next_nodes
+
+		return found, positions
+
+	def get_end(self, idiom_idx, words, positions):
+		'''
+		Gets the end offset of a plain idiom found by lookup, and the number of
+		intervening words. Of all ways to match the
+		idiom, the regex picks the one with the most intervening words before the 
+		second idiom word, then before the third, etc. Going backwards, first find the
+		positions from which the rest of the idiom can still be matched, then go 
+		forward, picking the largest number of intervening words each time.
+		'''
+
+		tokens = self.plain[idiom_idx]
+		nodes = [self.root]
+		for token in tokens:
+			nodes.append(nodes[-1][token])
+		# Positions after each token from which the rest of the idiom can be matched
+		completable = [None] * len(tokens) + [positions[id(nodes[-1])]]
+		for token_idx in range(len(tokens) - 1, 0, -1):
+			token = tokens[token_idx]
+			completable[token_idx] = set()
+			for word_idx in positions[id(nodes[token_idx])]:
+				for next_word_idx in self.get_window(token[0], word_idx, len(words)):
+					if next_word_idx + 1 in completable[token_idx + 1] and self.matches_token(token, words[next_word_idx][1]):
+						completable[token_idx].add(word_idx)
+						break
+		# Pick the path of the regex
+		word_idx = min(positions[id(self.root)])
+		num_intervening_words = 0
+		for token_idx, token in enumerate(tokens):
+			for next_word_idx in reversed(self.get_window(token[0], word_idx, len(words))):
+				if next_word_idx + 1 in completable[token_idx + 1] and self.matches_token(token, words[next_word_idx][1]):
+					num_intervening_words += next_word_idx - word_idx
+					word_idx = next_word_idx + 1
+					break
+		last_word = words[word_idx - 1]
+
+		return last_word[0] + len(last_word[1]), num_intervening_words
+
+	def get_words(self, sentence):
+		'''Splits a sentence into words, returns list of (start, text).'''
+
+		if self.case_sensitive:
+			return [(word.start(), word.group()) for word in WORD_REGEX.finditer(sentence)]
+		else:
+			return [(word.start(), word.group().lower()) for word in WORD_REGEX.finditer(sentence)]
+
+	def finditer(self, sentence):
+		'''
+		Finds all non-overlapping idiom matches in a sentence, like re.finditer,
+		yields (idiom_idx, match) tuples, where match is a regex match object.
+		'''
+
+		words = self.get_words(sentence)
+
+		# Collect candidate match starts, format: (start, idiom_idx)
+		candidates = set()
+		ends = {} # End offsets of plain idioms, format: {(start, idiom_idx): (end, num_intervening_words)}
+		for word_idx, word in enumerate(words):
+			found, positions = self.lookup(words, word_idx)
+			for idiom_idx, lead_length in found:
+				if word[0] >= lead_length:
+					candidates.add((word[0] - lead_length, idiom_idx))
+					if idiom_idx in self.plain:
+						time_0 = time.time()
+						ends[(word[0] - lead_length, idiom_idx)] = self.get_end(idiom_idx, words, positions)
+						self.stats['gap_time'] += time.time() - time_0
+		for idiom_idx in self.unindexed:
+			for start in range(len(sentence)):
+				if self.get_pattern(idiom_idx).match(sentence, start):
+					candidates.add((start, idiom_idx))
+
+		# Confirm candidates in order of position and idiom list order, plain idioms need no confirmation
+		position = 0
+		for start, idiom_idx in sorted(candidates):
+			if start < position:
+				continue
+			if (start, idiom_idx) in ends:
+				end, num_intervening_words = ends[(start, idiom_idx)]
+				match = WordMatch(sentence, start, end)
+				self.stats['intervening_words'] += num_intervening_words
+				self.stats['gap_matches'] += num_intervening_words > 0
+			else:
+				match = self.get_pattern(idiom_idx).match(sentence, start)
+			if match:
+				self.stats['matches'] += 1
+				yield idiom_idx, match
+				position = match.end()
+
+	def resolve(self, sentence, start):
+		'''Gets the index of the idiom matched at start by the alternation of all idiom regexes.'''
+
+		words = self.get_words(sentence)
+
+		# Only the words at or just after the start can begin the matched idiom
+		candidates = set(self.unindexed)
+		first_word_idx = bisect.bisect_left([word[0] for word in words], start)
+		for word_idx in range(first_word_idx, len(words)):
+			if words[word_idx][0] > start + self.max_lead_length:
+				break
+			for idiom_idx, lead_length in self.lookup(words, word_idx)[0]:
+				if words[word_idx][0] - lead_length == start:
+					candidates.add(idiom_idx)
+
+		# The alternation matches the first idiom in the list that matches
+		for idiom_idx in sorted(candidates):
+			if self.get_pattern(idiom_idx).match(sentence, start):
+				return idiom_idx
+
+class AnchorIndex:
+	'''
+	Inverted index of idioms by their rarest word, their anchor. Serves as a
+	prefilter: a sentence can only contain an idiom if it contains the anchor
+	of that idiom. Word rarity is based on word counts of the sentences seen
+	so far, and on word counts in the idiom list before that. Any word which
+	must occur in all matches of an idiom can be its anchor, so reselecting
+	anchors while counting does not change which sentences contain idioms.
+	An idiom word can also be a tuple of word forms, one of which must occur.
+	'''
+
+	def __init__(self, idiom_words, fuzzy = False):
+		self.idiom_words = idiom_words # List of lists of words (or tuples of word forms) which occur in all matches of an idiom, indexed like the idiom list
+		self.fuzzy = fuzzy
+		self.dictionary_counts = Counter([word for words in idiom_words for word in set(words)])
+		self.word_counts = Counter()
+		self.num_counted_sentences = 0
+		self.select_anchors()
+
+	def select_anchors(self):
+		'''Indexes each idiom by its rarest word. Idioms without words are always candidates.'''
+
+		self.index = {} # Format: {anchor: [idiom_idx]}
+		self.unanchored = []
+		for idiom_idx, words in enumerate(self.idiom_words):
+			if words:
+				anchor = min(words, key = self.get_rarity)
+				for form in self.get_forms(anchor):
+					self.index.setdefault(form, []).append(idiom_idx)
+			else:
+				self.unanchored.append(idiom_idx)
+
+	def get_forms(self, word):
+		'''Gets the word forms of an idiom word, which is a word or a tuple of word forms.'''
+
+		if isinstance(word, tuple):
+			return word
+		else:
+			return (word,)
+
+	def get_rarity(self, word):
+		'''Sorting key of idiom words, rarest first.'''
+
+		return (sum([self.word_counts[form] for form in self.get_forms(word)]), self.dictionary_counts[word], word)
+
+	def count_words(self, words):
+		'''Counts the words of a sentence, reselects anchors after a number of sentences. Stops counting after the last reselection.'''
+
+		if self.num_counted_sentences >= ANCHOR_UPDATES[-1]:
+			return
+		self.word_counts.update(words)
+		self.num_counted_sentences += 1
+		if self.num_counted_sentences in ANCHOR_UPDATES:
+			self.select_anchors()
+		# Anchors are final, so the counts are no longer needed
+		if self.num_counted_sentences == ANCHOR_UPDATES[-1]:
+			self.word_counts = Counter()
+
+	def get_keys(self, words):
+		'''Gets index keys for sentence words, with fuzzy matching also words without a suffix of up to three characters.'''
+
+		if not self.fuzzy:
+			return words
+		keys = []
+		for word in words:
+			for suffix_length in range(4):
+				if len(word) > suffix_length:
+					keys.append(word[:len(word) - suffix_length])
+
+		return keys
+
+	def contains_anchor(self, words):
+		'''Checks whether a sentence, given as list of words, can contain any idiom.'''
+
+		if self.unanchored:
+			return True
+		for key in self.get_keys(words):
+			if key in self.index:
+				return True
+
+		return False
+
+	def get_candidates(self, words):
+		'''Gets sorted indices of the idioms a sentence, given as list of words, can contain.'''
+
+		candidates = set(self.unanchored)
+		for key in self.get_keys(words):
+			if key in self.index:
+				candidates.update(self.index[key])
+
+		return sorted(candidates)
+
+class IdiomMatcher:
+	'''
+	Everything needed to extract idioms by string matching: the expanded
+	and/or inflected idiom list, the dictionary form of each idiom, the
+	idiom trie, and the regular expression matching all idioms. Inflected
+	idioms are either listed separately, or as a single idiom with the word
+	forms of each word.
+	'''
+
+	def __init__(self, idioms, dictionary_forms, int_words = 0, fuzzy = False, case_sensitive = False, word_forms = None):
+		self.idioms = idioms
+		self.dictionary_forms = dictionary_forms # Indexed like idioms
+		self.case_sensitive = case_sensitive
+		# A matched string which literally is an idiom is that idiom, format: {idiom: idiom_idx}
+		self.idiom_indices = {}
+		for idiom_idx, idiom in enumerate(idioms):
+			self.idiom_indices.setdefault(idiom, idiom_idx)
+		self.trie = IdiomTrie(idioms, int_words = int_words, fuzzy = fuzzy, case_sensitive = case_sensitive, word_forms = word_forms)
+		self.regex = '|'.join([idiom_to_regex(idiom, self.trie.separator, fuzzy, self.trie.get_idiom_forms(idiom_idx)) for idiom_idx, idiom in enumerate(idioms)])
+		self.flags = self.trie.flags
+		self.pattern = None # Regex matching all idioms, compiled on first use
+		# Literal, fuzzy and lemma words of idioms are the possible anchors for the prefilter
+		idiom_words = []
+		for idiom_idx, idiom in enumerate(idioms):
+			idiom_words.append([text for gap_allowed, kind, text in self.trie.get_tokens(idiom, self.trie.get_idiom_forms(idiom_idx))[0] if kind != WILDCARD])
+		self.anchor_index = AnchorIndex(idiom_words, fuzzy = fuzzy)
+
+	# Don't pickle the compiled regex, it is large and quickly compiled on demand
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state['pattern'] = None
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+
+	def get_pattern(self):
+		'''
+		Gets the compiled regex matching all idioms. Keeping it, rather than relying on the
+		cache of the re module, avoids recompiling it when that cache is cleared.
+		'''
+
+		if self.pattern is None:
+			self.pattern = re.compile(self.regex, self.flags)
+
+		return self.pattern
+
+	def may_contain_idiom(self, sentence):
+		'''Prefilter: checks whether a sentence contains any idiom anchor, counts its words for anchor selection.'''
+
+		words = [text for start, text in self.trie.get_words(sentence)]
+		self.anchor_index.count_words(words)
+
+		return self.anchor_index.contains_anchor(words)
+
+	def get_exact_idiom(self, match):
+		'''Gets the index of the idiom the matched string literally is, or None if it is not in the idiom list.'''
+
+		matched_string = match.group()
+		if not self.case_sensitive:
+			matched_string = matched_string.lower()
+
+		return self.idiom_indices.get(matched_string)
+
+	def finditer(self, sentence, engine = 'regex'):
+		'''
+		Finds all idioms in a sentence, yields (dictionary_form, match) tuples. A matched
+		string occurring exactly in the idiom list gets the dictionary form of that idiom,
+		other matches that of the first idiom matching there.
+		'''
+
+		if engine == 'regex':
+			for match in self.get_pattern().finditer(sentence):
+				idiom_idx = self.get_exact_idiom(match)
+				# The trie tells which idiom was matched by the regular expression
+				if idiom_idx is None:
+					idiom_idx = self.trie.resolve(sentence, match.start())
+				yield self.dictionary_forms[idiom_idx], match
+		elif engine == 'trie':
+			for idiom_idx, match in self.trie.finditer(sentence):
+				exact_idiom_idx = self.get_exact_idiom(match)
+				if exact_idiom_idx is not None:
+					idiom_idx = exact_idiom_idx
+				yield self.dictionary_forms[idiom_idx], match
+
+	def pop_stats(self):
+		'''Returns and resets the intervening word statistics of the trie engine.'''
+
+		stats = self.trie.stats
+		self.trie.stats = Counter()
+
+		return stats
+
+def get_cache_path(work_dir, idioms, options):
+	'''Gets location of cached matcher, named by a hash of the idiom list and matching options.'''
+
+	key = json.dumps([CACHE_VERSION, idioms, options], sort_keys = True)
+	key_hash = hashlib.sha1(key).hexdigest()
+
+	return os.path.join(work_dir, 'idiom_matcher_{0}.pickle'.format(key_hash))
+
+def save_matcher(matcher, cache_path):
+	'''Caches matcher in a pickle file, written under a temporary name first, so that an interrupted run leaves no truncated cache.'''
+
+	with open(cache_path + '.tmp', 'wb') as of:
+		pickle.dump(matcher, of, pickle.HIGHEST_PROTOCOL)
+	os.rename(cache_path + '.tmp', cache_path)
+	print 'Caching idiom matcher in {0}'.format(cache_path)
+
+def load_matcher(cache_path):
+	'''Loads cached matcher from a pickle file.'''
+
+	time_0 = time.time()
+	print 'Reading idiom matcher from {0}'.format(cache_path)
+	with open(cache_path, 'rb') as f:
+		matcher = pickle.load(f)
+	print 'Done! Reading idiom matcher took {0:.2f} seconds'.format(time.time() - time_0)
+
+	return matcher
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Compile parsed idioms into tree patterns for the parse-based extraction method, and match them to sentence parses.'''
+
+import re, hashlib, json, os, time
+import cPickle as pickle
+
+# Version of the cached pattern format, change to invalidate existing caches
+CACHE_VERSION = 1
+
+# Idiom tokens which are not matched to the sentence parse
+ARTICLES = ['a', 'the', 'an']
+
+# Tags of sentence tokens that can fill the place of indefinite pronouns in idioms
+NOUN_TAGS = ['NN', 'NNS', 'NNP', 'NNPS']
+PRONOUN_NOUN_TAGS = ['PRP'] + NOUN_TAGS
+DEMONSTRATIVES = ['this', 'that', 'these', 'those']
+
+# Kinds of special idiom tokens: someone/something, someone's/something's, one's, and the 's following those
+SOMEONE = 1
+SOMETHING = 2
+POSSESSIVE = 3
+ONE_POSSESSIVE = 4
+IGNORED = 5
+
+# Spacy gives the same lemma to all pronouns
+PRONOUN_LEMMA = u'-PRON-'
+
+class TokenPattern:
+	'''
+	Constraints on a single idiom token: its lemma, dependency relation and head lemma,
+	plus em-dash wildcard flags and the kind of special case it is, if any.
+	'''
+
+	def __init__(self, token, has_em_dash, ambiguous_word):
+		# Match pronouns on lower-cased form, other tokens on lemma
+		self.is_pronoun = token.lemma_ == PRONOUN_LEMMA
+		self.key = token.lower_ if self.is_pronoun else token.lemma_
+		self.head_is_pronoun = token.head.lemma_ == PRONOUN_LEMMA
+		self.head_key = token.head.lower_ if self.head_is_pronoun else token.head.lemma_
+		self.dep = token.dep_
+		self.is_dobj = token.dep_ == 'dobj'
+		self.em_dash_lemma = bool(has_em_dash) and token.lemma_ == ambiguous_word
+		self.em_dash_head_lemma = bool(has_em_dash) and token.head.lemma_ == ambiguous_word
+		self.special = self.get_special(token)
+
+	def get_special(self, token):
+		'''Determines whether the token is someone, someone's, one's, something, something's, or the 's of those.'''
+
+		right_children = [right for right in token.rights]
+		has_possessive = bool(right_children) and right_children[0].lemma_ == "'s"
+		if token.lemma_ == 'someone':
+			return POSSESSIVE if has_possessive else SOMEONE
+		if token.lemma_ == 'one':
+			return ONE_POSSESSIVE if has_possessive else None
+		if token.lemma_ == 'something':
+			return POSSESSIVE if has_possessive else SOMETHING
+		if token.lemma_ == "'s" and token.head.lemma_ in ['someone', 'one', 'something']:
+			return IGNORED
+		return None
+
+class IdiomPattern:
+	'''
+	Parse tree pattern of a single idiom, compiled once from the parsed idiom, so that matching
+	does not have to inspect the idiom parse again for every sentence token. Only holds strings
+	and flags, no Spacy objects.
+	'''
+
+	def __init__(self, parsed_idiom, idiom_subtree, ambiguous_word, no_labels = False, no_direction = False):
+		top_token = parsed_idiom[1]
+		has_em_dash = parsed_idiom[3]
+		self.no_labels = no_labels
+		self.no_direction = no_direction
+		self.top_lemma = top_token.lemma_
+		# Idioms with an em-dash as top token are only matched if their other content words occur in the sentence
+		self.em_dash_top = bool(has_em_dash) and parsed_idiom[0] == ambiguous_word
+		self.content_lemmata = set([token.lemma_ for token in idiom_subtree if token.tag_ not in ['DT'] and token != top_token])
+		self.subtree_lemmata = set([token.lemma_ for token in idiom_subtree])
+		# Constraints on all tokens except the top token and articles, in subtree order
+		self.token_patterns = [TokenPattern(token, has_em_dash, ambiguous_word) for token in idiom_subtree
+			if token != top_token and token.lower_ not in ARTICLES]
+		# Text of idiom subtree is dictionary form, substitute em-dash back in for ambiguous word
+		self.dictionary_form = ''.join([token.text_with_ws for token in idiom_subtree]).strip()
+		if has_em_dash:
+			self.dictionary_form = re.sub(ambiguous_word, u'\u2014', self.dictionary_form)
+
+	def matches_em_dash_heuristic(self, sentence_lemmata):
+		'''Checks whether an em-dash top idiom should be considered, i.e. all its content lemmata occur in the sentence.'''
+
+		return self.em_dash_top and self.content_lemmata <= sentence_lemmata
+
+	def is_top_candidate(self, sentence_token):
+		'''Checks whether a sentence token can be the top of the idiom, matching any idiom token in case of no directionality.'''
+
+		return sentence_token.lemma_ == self.top_lemma or (self.no_direction and sentence_token.lemma_ in self.subtree_lemmata)
+
+	def match_token(self, token_pattern, sentence_token):
+		'''
+		Matches a single idiom token pattern to a sentence token, accounting for many special cases.
+		Returns whether it matches, and the index of the matched token, which is None for ignored tokens.
+		'''
+
+		# Lemma has to match, except for em-dash wildcards and indefinite pronouns, so exit early if it doesn't
+		if token_pattern.is_pronoun:
+			matching_lemma = token_pattern.key == sentence_token.lower_
+		else:
+			matching_lemma = token_pattern.key == sentence_token.lemma_
+		if not matching_lemma and not token_pattern.em_dash_lemma and not token_pattern.special:
+			return False, None
+		# Optionally, ignore dependency labels
+		matching_dep = self.no_labels or token_pattern.dep == sentence_token.dep_
+		if token_pattern.head_is_pronoun:
+			matching_head_lemma = token_pattern.head_key == sentence_token.head.lower_
+		else:
+			matching_head_lemma = token_pattern.head_key == sentence_token.head.lemma_
+		# Optionally, allow for direction reversal
+		matched_child = None
+		if self.no_direction:
+			for child in sentence_token.children:
+				if (child.lower_ if token_pattern.head_is_pronoun else child.lemma_) == token_pattern.head_key:
+					matched_child = child
+					break
+			matching_head_lemma = matching_head_lemma or matched_child is not None
+		inverted_dep = self.no_labels or token_pattern.is_dobj and sentence_token.dep_ == 'nsubjpass'
+
+		# Default case: lemma, dep-rel and head lemma have to match.
+		# In case of em-dash, match lemma or head lemma, and the other one to the ambiguous word
+		# Passivization: match lemma, head lemma and inverted dep-rels
+		if (matching_lemma and matching_dep and matching_head_lemma or
+				token_pattern.em_dash_lemma and matching_head_lemma or
+				matching_lemma and token_pattern.em_dash_head_lemma or
+				matching_lemma and inverted_dep and matching_head_lemma):
+			matched = True
+		# Deal with someone's and something's - match any other PRP$ or NN(P)(S) + POS for lemma
+		elif token_pattern.special == POSSESSIVE:
+			matched = matching_dep and matching_head_lemma and (sentence_token.tag_ == 'PRP$' or
+				sentence_token.tag_ in NOUN_TAGS and self.has_possessive(sentence_token))
+		# Deal with someone - match any other PRP or NN(P)(S) for lemma
+		elif token_pattern.special == SOMEONE:
+			matched = (matching_dep or inverted_dep) and matching_head_lemma and sentence_token.tag_ in PRONOUN_NOUN_TAGS
+		# Deal with something - match any other PRP or NN(P)(S) or this/that/these/those for lemma
+		elif token_pattern.special == SOMETHING:
+			matched = (matching_dep or inverted_dep) and matching_head_lemma and (sentence_token.tag_ in PRONOUN_NOUN_TAGS or
+				sentence_token.lemma_ in DEMONSTRATIVES)
+		# Deal with one's - match any PRP$ for lemma
+		elif token_pattern.special == ONE_POSSESSIVE:
+			matched = matching_dep and matching_head_lemma and sentence_token.tag_ == 'PRP$'
+		# Deal with 's of someone's, one's and something's by ignoring it
+		elif token_pattern.special == IGNORED:
+			return True, None
+		else:
+			matched = False
+
+		if not matched:
+			return False, None
+		# Add child in case of no-directionality child match
+		if matched_child is not None:
+			return True, matched_child.i
+		return True, sentence_token.i
+
+	def has_possessive(self, sentence_token):
+		'''Checks whether the first right child of a sentence token is a possessive 's.'''
+
+		for right in sentence_token.rights:
+			return right.lemma_ == "'s"
+		return False
+
+	def match(self, sentence_top_token):
+		'''
+		Matches the idiom tree to the subtree of a sentence token, which is taken to be the top token. Returns
+		whether it matches, or None if there are no idiom tokens to match, and the indices of the matching tokens.
+		'''
+
+		if not self.token_patterns:
+			return None, [sentence_top_token.i]
+		# Keep track of indices of matching tokens for later span extraction
+		matched_indices = [sentence_top_token.i]
+		sentence_subtree = [token for token in sentence_top_token.subtree]
+		for token_pattern in self.token_patterns:
+			for sentence_subtree_token in sentence_subtree:
+				matched, matched_index = self.match_token(token_pattern, sentence_subtree_token)
+				if matched: # Match, go to next idiom token
+					if matched_index is not None:
+						matched_indices.append(matched_index)
+					break
+			else: # No match for this idiom token, so no match for the idiom
+				return False, matched_indices
+
+		return True, matched_indices
+
+def get_cache_path(work_dir, idioms, options):
+	'''Gets location of cached idiom patterns, named by a hash of the idiom list and parsing options.'''
+
+	key = json.dumps([CACHE_VERSION, idioms, options], sort_keys = True)
+	key_hash = hashlib.sha1(key).hexdigest()
+
+	return os.path.join(work_dir, 'idiom_patterns_{0}.pickle'.format(key_hash))
+
+def save_patterns(idiom_patterns, cache_path):
+	'''Caches idiom patterns in a pickle file, written under a temporary name first, so that an interrupted run leaves no truncated cache.'''
+
+	with open(cache_path + '.tmp', 'wb') as of:
+		pickle.dump(idiom_patterns, of, pickle.HIGHEST_PROTOCOL)
+	os.rename(cache_path + '.tmp', cache_path)
+	print 'Caching idiom patterns in {0}'.format(cache_path)
+
+def load_patterns(cache_path, no_labels = False, no_direction = False):
+	'''
+	Loads cached idiom patterns from a pickle file. Matching options are not part of
+	the cache key, so they are set on the loaded patterns.
+	'''
+
+	time_0 = time.time()
+	print 'Reading idiom patterns from {0}'.format(cache_path)
+	with open(cache_path, 'rb') as f:
+		idiom_patterns = pickle.load(f)
+	for pattern in idiom_patterns:
+		pattern.no_labels = no_labels
+		pattern.no_direction = no_direction
+	print 'Done! Reading idiom patterns took {0:.2f} seconds'.format(time.time() - time_0)
+
+	return idiom_patterns
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Generate inflected forms of verbs and nouns in Python, as an alternative to morphg.
+Uses regular English inflection rules, morph's verbstem.list for consonant doubling,
+and tables of irregular verbs and nouns.
+'''
+
+import re, os
+
+# Irregular verbs, format: {'stem': ('past tense', 'past participle')}
+IRREGULAR_VERBS = {
+	'arise': ('arose', 'arisen'), 'awake': ('awoke', 'awoken'), 'bear': ('bore', 'borne'), 'beat': ('beat', 'beaten'),
+	'become': ('became', 'become'), 'begin': ('began', 'begun'), 'bend': ('bent', 'bent'), 'bet': ('bet', 'bet'),
+	'bid': ('bid', 'bid'), 'bind': ('bound', 'bound'), 'bite': ('bit', 'bitten'), 'bleed': ('bled', 'bled'),
+	'blow': ('blew', 'blown'), 'break': ('broke', 'broken'), 'breed': ('bred', 'bred'), 'bring': ('brought', 'brought'),
+	'build': ('built', 'built'), 'burn': ('burnt', 'burnt'), 'burst': ('burst', 'burst'), 'buy': ('bought', 'bought'),
+	'cast': ('cast', 'cast'), 'catch': ('caught', 'caught'), 'choose': ('chose', 'chosen'), 'cling': ('clung', 'clung'),
+	'come': ('came', 'come'), 'cost': ('cost', 'cost'), 'creep': ('crept', 'crept'), 'cut': ('cut', 'cut'),
+	'deal': ('dealt', 'dealt'), 'dig': ('dug', 'dug'), 'do': ('did', 'done'), 'draw': ('drew', 'drawn'),
+	'dream': ('dreamt', 'dreamt'), 'drink': ('drank', 'drunk'), 'drive': ('drove', 'driven'), 'eat': ('ate', 'eaten'),
+	'fall': ('fell', 'fallen'), 'feed': ('fed', 'fed'), 'feel': ('felt', 'felt'), 'fight': ('fought', 'fought'),
+	'find': ('found', 'found'), 'flee': ('fled', 'fled'), 'fling': ('flung', 'flung'), 'fly': ('flew', 'flown'),
+	'forbid': ('forbade', 'forbidden'), 'forget': ('forgot', 'forgotten'), 'forgive': ('forgave', 'forgiven'), 'freeze': ('froze', 'frozen'),
+	'get': ('got', 'got'), 'give': ('gave', 'given'), 'go': ('went', 'gone'), 'grind': ('ground', 'ground'),
+	'grow': ('grew', 'grown'), 'hang': ('hung', 'hung'), 'have': ('had', 'had'), 'hear': ('heard', 'heard'),
+	'hide': ('hid', 'hidden'), 'hit': ('hit', 'hit'), 'hold': ('held', 'held'), 'hurt': ('hurt', 'hurt'),
+	'keep': ('kept', 'kept'), 'kneel': ('knelt', 'knelt'), 'know': ('knew', 'known'), 'lay': ('laid', 'laid'),
+	'lead': ('led', 'led'), 'lean': ('leant', 'leant'), 'leap': ('leapt', 'leapt'), 'learn': ('learnt', 'learnt'),
+	'leave': ('left', 'left'), 'lend': ('lent', 'lent'), 'let': ('let', 'let'), 'lie': ('lay', 'lain'),
+	'light': ('lit', 'lit'), 'lose': ('lost', 'lost'), 'make': ('made', 'made'), 'mean': ('meant', 'meant'),
+	'meet': ('met', 'met'), 'mistake': ('mistook', 'mistaken'), 'overcome': ('overcame', 'overcome'), 'pay': ('paid', 'paid'),
+	'put': ('put', 'put'), 'quit': ('quit', 'quit'), 'read': ('read', 'read'), 'rid': ('rid', 'rid'),
+	'ride': ('rode', 'ridden'), 'ring': ('rang', 'rung'), 'rise': ('rose', 'risen'), 'run': ('ran', 'run'),
+	'say': ('said', 'said'), 'see': ('saw', 'seen'), 'seek': ('sought', 'sought'), 'sell': ('sold', 'sold'),
+	'send': ('sent', 'sent'), 'set': ('set', 'set'), 'shake': ('shook', 'shaken'), 'shed': ('shed', 'shed'),
+	'shine': ('shone', 'shone'), 'shoot': ('shot', 'shot'), 'show': ('showed', 'shown'), 'shrink': ('shrank', 'shrunk'),
+	'shut': ('shut', 'shut'), 'sing': ('sang', 'sung'), 'sink': ('sank', 'sunk'), 'sit': ('sat', 'sat'),
+	'sleep': ('slept', 'slept'), 'slide': ('slid', 'slid'), 'sling': ('slung', 'slung'), 'slit': ('slit', 'slit'),
+	'smell': ('smelt', 'smelt'), 'speak': ('spoke', 'spoken'), 'speed': ('sped', 'sped'), 'spell': ('spelt', 'spelt'),
+	'spend': ('spent', 'spent'), 'spill': ('spilt', 'spilt'), 'spin': ('spun', 'spun'), 'spit': ('spat', 'spat'),
+	'split': ('split', 'split'), 'spoil': ('spoilt', 'spoilt'), 'spread': ('spread', 'spread'), 'spring': ('sprang', 'sprung'),
+	'stand': ('stood', 'stood'), 'steal': ('stole', 'stolen'), 'stick': ('stuck', 'stuck'), 'sting': ('stung', 'stung'),
+	'stink': ('stank', 'stunk'), 'stride': ('strode', 'stridden'), 'strike': ('struck', 'struck'), 'string': ('strung', 'strung'),
+	'strive': ('strove', 'striven'), 'swear': ('swore', 'sworn'), 'sweep': ('swept', 'swept'), 'swell': ('swelled', 'swollen'),
+	'swim': ('swam', 'swum'), 'swing': ('swung', 'swung'), 'take': ('took', 'taken'), 'teach': ('taught', 'taught'),
+	'tear': ('tore', 'torn'), 'tell': ('told', 'told'), 'think': ('thought', 'thought'), 'throw': ('threw', 'thrown'),
+	'thrust': ('thrust', 'thrust'), 'tread': ('trod', 'trodden'), 'undergo': ('underwent', 'undergone'), 'understand': ('understood', 'understood'),
+	'undertake': ('undertook', 'undertaken'), 'upset': ('upset', 'upset'), 'wake': ('woke', 'woken'), 'wear': ('wore', 'worn'),
+	'weave': ('wove', 'woven'), 'weep': ('wept', 'wept'), 'win': ('won', 'won'), 'wind': ('wound', 'wound'),
+	'withdraw': ('withdrew', 'withdrawn'), 'withhold': ('withheld', 'withheld'), 'withstand': ('withstood', 'withstood'), 'wring': ('wrung', 'wrung'),
+	'write': ('wrote', 'written'),
+}
+
+# Irregular third person singular present tense forms
+IRREGULAR_PRESENT = {'have': 'has'}
+
+# Irregular plural nouns, format: {'singular': 'plural'}
+IRREGULAR_NOUNS = {
+	'man': 'men', 'woman': 'women', 'child': 'children', 'foot': 'feet', 'tooth': 'teeth', 'goose': 'geese',
+	'mouse': 'mice', 'louse': 'lice', 'ox': 'oxen', 'person': 'people', 'penny': 'pence', 'die': 'dice',
+	'leaf': 'leaves', 'life': 'lives', 'knife': 'knives', 'wife': 'wives', 'half': 'halves', 'wolf': 'wolves',
+	'calf': 'calves', 'shelf': 'shelves', 'thief': 'thieves', 'loaf': 'loaves', 'self': 'selves', 'sheaf': 'sheaves',
+	'sheep': 'sheep', 'fish': 'fish', 'deer': 'deer', 'series': 'series', 'species': 'species', 'aircraft': 'aircraft',
+	'potato': 'potatoes', 'tomato': 'tomatoes', 'hero': 'heroes', 'echo': 'echoes', 'veto': 'vetoes', 'torpedo': 'torpedoes',
+}
+
+VOWELS = 'aeiou'
+
+class Inflector:
+	'''
+	Generates inflected forms from morphg input tokens, e.g. 'shoot+ing_V'. Stems
+	listed in verbstem.list double their final consonant before -ing and -ed.
+	'''
+
+	def __init__(self, verbstem_file):
+		self.doubling_stems = set()
+		if os.path.isfile(verbstem_file):
+			with open(verbstem_file, 'r') as f:
+				self.doubling_stems = set(f.read().split())
+		else:
+			print 'Could not find {0}, inflecting without consonant doubling'.format(verbstem_file)
+
+	def match_case(self, form, stem):
+		'''Applies capitalization of the stem to a generated form.'''
+
+		if stem.isupper() and len(stem) > 1:
+			return form.upper()
+		elif stem[:1].isupper():
+			return form[:1].upper() + form[1:]
+		else:
+			return form
+
+	def add_s(self, stem, is_verb):
+		'''Adds third person singular -s to verbs, or plural -s to nouns.'''
+
+		if re.search('(s|x|z|ch|sh)$', stem):
+			return stem + 'es'
+		elif re.search('[^' + VOWELS + ']y$', stem):
+			return stem[:-1] + 'ies'
+		elif is_verb and re.search('[^' + VOWELS + ']o$', stem):
+			return stem + 'es'
+		else:
+			return stem + 's'
+
+	def add_vowel_suffix(self, stem, suffix):
+		'''Adds -ing or -ed, with consonant doubling and deletion of final e.'''
+
+		if stem in self.doubling_stems:
+			if stem.endswith('c'):
+				return stem + 'k' + suffix
+			return stem + stem[-1] + suffix
+		if suffix == 'ing':
+			if stem.endswith('ie'):
+				return stem[:-2] + 'ying'
+			elif re.search('[^eoy]e$', stem):
+				return stem[:-1] + 'ing'
+			return stem + 'ing'
+		else:
+			if stem.endswith('e'):
+				return stem + 'd'
+			elif re.search('[^' + VOWELS + ']y$', stem):
+				return stem[:-1] + 'ied'
+			return stem + 'ed'
+
+	def inflect(self, stem, inflection, is_verb):
+		'''Generates the inflected form of a stem, inflection is 's', 'ing', 'ed' or 'en'.'''
+
+		lower_stem = stem.lower()
+		if is_verb:
+			if inflection == 's':
+				form = IRREGULAR_PRESENT.get(lower_stem) or self.add_s(lower_stem, True)
+			elif inflection == 'ing':
+				form = self.add_vowel_suffix(lower_stem, 'ing')
+			elif lower_stem in IRREGULAR_VERBS:
+				form = IRREGULAR_VERBS[lower_stem][inflection == 'en']
+			else:
+				form = self.add_vowel_suffix(lower_stem, 'ed')
+		else:
+			form = IRREGULAR_NOUNS.get(lower_stem) or self.add_s(lower_stem, False)
+
+		return self.match_case(form, stem)
+
+	def inflect_tokens(self, token_lists):
+		'''
+		Takes list of lists of token+inflection_POS strings, like morphg_batch,
+		returns list of tuples of inflected tokens. Failed inflections are left out.
+		'''
+
+		inflected_token_lists = []
+		for tokens in token_lists:
+			inflected_tokens = []
+			for token in tokens:
+				match = re.match('^(.+)\\+(s|ing|ed|en)_(.+)$', token)
+				if match:
+					inflected_tokens.append(self.inflect(match.group(1), match.group(2), match.group(3).startswith('V')))
+			inflected_token_lists.append(tuple(inflected_tokens))
+
+		return inflected_token_lists
@@ -6,14 +6,17 @@ Get idioms from the online Oxford Dictionary of English Idioms, by scraping the
 Refines the idioms by removing duplicates, and expanding things in parentheses, dealing with special cases. 
 '''
 
-import re, requests, itertools
-from bs4 import BeautifulSoup
+import re, itertools
 
 def get_idioms(url, landing_url, use_socks_proxy = False):
 	'''
 	Scrapes idioms from the ODEI website, gets 100 entries per page, 
 	navigates to entry page, gets idiom, cycles through pages
 	'''
+	# Only needed for scraping, not for refining cached idiom lists
+	import requests
+	from bs4 import BeautifulSoup
+
 	idioms = []
 	# Set proxy, if applicable, requires pysocks to be installed
 	if use_socks_proxy:
@@ -4,24 +4,27 @@
 '''Load and preprocess a corpus for idiom extraction'''
 
 import os, time, json
-import nltk.data
-from bs4 import BeautifulSoup
 
-def plain_text(corpus_file, no_split):
-	'''Read in a plain text corpus, return a single document containing a list of unicode sentences.'''	
+def iter_plain_text(corpus_file, no_split):
+	'''Read in a plain text corpus lazily, yield unicode sentences one at a time.'''
 
-	splitter = nltk.data.load('tokenizers/punkt/english.pickle')
-	# Read in corpus
-	documents = []
-	sentences = []
+	# Only load the sentence splitter when splitting
+	if not no_split:
+		import nltk.data
+		splitter = nltk.data.load('tokenizers/punkt/english.pickle')
 	with open(corpus_file, 'r') as f:
 		for line in f:
 			if line.strip():
 				if no_split:
-					sentences.append(unicode(line.strip(), 'utf-8'))
+					yield unicode(line.strip(), 'utf-8')
 				else:
-					sentences += splitter.tokenize(unicode(line.strip(), 'utf-8'))
-	documents.append(sentences)
+					for sentence in splitter.tokenize(unicode(line.strip(), 'utf-8')):
+						yield sentence
+
+def plain_text(corpus_file, no_split):
+	'''Read in a plain text corpus, return a single document containing a list of unicode sentences.'''	
+
+	documents = [list(iter_plain_text(corpus_file, no_split))]
 	
 	return documents
 
@@ -40,6 +43,7 @@ def bnc(corpus_file, corpus_type, cache_path):
 		return documents
 		
 	# Read BNC from file and parse, if no cached version available
+	from bs4 import BeautifulSoup
 	time_0 = time.time()
 	print 'Processing BNC...'
 	# Cycle through subdirectories
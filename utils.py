@@ -1,20 +1,25 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-'''Utility functions to work with morpha, PoS-tagging, parsing, and other things.'''
+'''
+Utility functions to work with morpha, PoS-tagging, parsing, and other things.
+Spacy, its model, stanfordcorenlp and nltk are only imported by the functions that use them, as they take long to load.
+'''
 
 import pos2morpha
+import idiom_matcher
+import inflector
 
-import subprocess, shlex, time, json, re, itertools, csv
-import spacy
-import en_core_web_sm as spacy_model 
-from stanfordcorenlp import StanfordCoreNLP
-import nltk.data
+import subprocess, shlex, time, json, re, itertools, csv, os, hashlib, bisect, urllib, urllib2, importlib, resource, multiprocessing
+import cPickle as pickle
+from multiprocessing.pool import ThreadPool
 
 ###### STANFORD TO SPACY ######
-class StanfordDoc:
+class StanfordDoc(object):
 	'''Spacy-Doc-like container for Stanford output'''
 
+	__slots__ = ('sents', 'tokens')
+
 	def __init__(self):
 		self.sents = []
 
@@ -31,15 +36,24 @@ class StanfordDoc:
 	def set_tokens(self):
 		self.tokens = [token for sent in self.sents for token in sent]
 
-class StanfordSpan:
+class StanfordSpan(object):
 	'''Spacy-Span-like container for Stanford output'''
 
+	__slots__ = ('tokens', 'start', 'start_char')
+
 	def __init__(self, tokens):
 		self.tokens = tokens
 		self.start = self.tokens[0].i # Starting token index in document
 		self.start_char = self.tokens[0].idx # Starting character index in document
-		self.text_with_ws = ''.join([token.text_with_ws for token in self.tokens])
-		self.text = ''.join([token.text_with_ws for token in self.tokens[:-1]]) + self.tokens[-1].text
+
+	# Texts are only needed for sentences containing idioms, so get them on demand
+	@property
+	def text_with_ws(self):
+		return ''.join([token.text_with_ws for token in self.tokens])
+
+	@property
+	def text(self):
+		return ''.join([token.text_with_ws for token in self.tokens[:-1]]) + self.tokens[-1].text
 
 	def __iter__(self):
 		return iter(self.tokens)
@@ -47,9 +61,11 @@ class StanfordSpan:
 	def __getitem__(self, i):
 		return self.tokens[i]
 
-class StanfordToken:
+class StanfordToken(object):
 	'''Spacy-Token-like container for Stanford output'''
 
+	__slots__ = ('i', 'idx', 'lemma_', 'tag_', 'text', 'text_with_ws', 'lower_', 'children', 'doc', 'head', 'head_idx', 'dep_', '_subtree', '_rights')
+
 	def __init__(self, i, idx, lemma, tag, text, ws, word, doc):
 		self.i = i # Token index in document
 		self.idx = idx # Starting character index in document
@@ -60,24 +76,32 @@ class StanfordToken:
 		self.lower_ = word.lower()
 		self.children = []
 		self.doc = doc
+		self._subtree = None
+		self._rights = None
 
 	def __str__(self):
 		return self.text
 
-	# Recursively gets all the syntactic descendants of a token, including self
+	# Gets all the syntactic descendants of a token, including self, from the memoized subtrees of its children
 	def get_descendants(self):
 		descendants = [self]
 		for child in self.children:
-			descendants += child.get_descendants()
+			descendants += child.subtree
 		return descendants
 
-	# Sets the subtree attribute, which is an ordered generator for all descendants of a token
-	def get_subtree(self):
-		return sorted(self.get_descendants(), key=lambda x: x.i)
+	# Ordered list of all descendants of a token, computed on first use
+	@property
+	def subtree(self):
+		if self._subtree is None:
+			self._subtree = sorted(self.get_descendants(), key=lambda x: x.i)
+		return self._subtree
 
-	# Sets the rights attribute, which is an ordered generator for all children to the right of a token
-	def get_rights(self):
-		return [child for child in self.children if child.i > self.i]
+	# Ordered list of all children to the right of a token, computed on first use
+	@property
+	def rights(self):
+		if self._rights is None:
+			self._rights = [child for child in self.children if child.i > self.i]
+		return self._rights
 
 	def __repr__(self):
 		return self.text
@@ -117,57 +141,389 @@ def stanford_to_spacy(parse):
 				new_token.dep_ = u'ROOT'
 				new_token.head = new_token
 				print 'Headless word \'{0}\' in sentence "{1}"'.format(new_token.text.encode('utf-8'), ''.join([x.text_with_ws.encode('utf-8') for x in span]))
-		# Add subtree to each token
-		for new_token in span:
-			new_token.subtree = new_token.get_subtree()
-			new_token.rights = new_token.get_rights()
 		doc.sents.append(StanfordSpan(span))
 	# Generate token list
 	doc.set_tokens()
 	
 	return doc
 
+class StanfordClient:
+	'''
+	Client for one or more CoreNLP servers. Packs many texts into a single request, 
+	and keeps several requests in flight, spread over the servers round-robin.
+	'''
+
+	# Annotators and output format for all requests. Two newlines always break sentences, so packed texts stay apart
+	PROPERTIES = {'annotators': 'tokenize,ssplit,pos,lemma,depparse', 'pipelineLanguage': 'en', 'outputFormat': 'json', 'ssplit.newlineIsSentenceBreak': 'two'}
+	SEPARATOR = u'\n\n'
+
+	def __init__(self, urls, requests_per_server = 2, timeout = 600, servers = None):
+		self.urls = [url.rstrip('/') for url in urls]
+		self.num_threads = len(self.urls) * requests_per_server
+		self.timeout = timeout
+		self.servers = servers or [] # Keep started servers alive as long as the client
+		self.pool = ThreadPool(self.num_threads)
+
+	def annotate(self, text, url = None):
+		'''Sends a (unicode) string to a CoreNLP server, returns its JSON output.'''
+
+		url = url or self.urls[0]
+		request_url = '{0}/?properties={1}'.format(url, urllib.quote(json.dumps(self.PROPERTIES)))
+		response = urllib2.urlopen(urllib2.Request(request_url, data = text.encode('utf-8')), timeout = self.timeout)
+
+		return json.loads(response.read())
+
+	def annotate_packed(self, texts, url):
+		'''
+		Sends a list of unicode strings to a CoreNLP server in a single request. Returns
+		the JSON output for each string, with character offsets relative to that string.
+		'''
+
+		# Newlines inside texts would be ambiguous with the separator, so replace them by spaces (which keeps offsets intact)
+		texts = [text.replace(u'\n', u' ') for text in texts]
+		starts = []
+		start = 0
+		for text in texts:
+			starts.append(start)
+			start += len(text) + len(self.SEPARATOR)
+		parsed_texts = [{'sentences': []} for text in texts]
+		if not texts:
+			return parsed_texts
+		# Map sentences back to texts by the offset of their first token
+		for sentence in self.annotate(self.SEPARATOR.join(texts), url)['sentences']:
+			if not sentence['tokens']:
+				continue
+			text_idx = bisect.bisect_right(starts, sentence['tokens'][0]['characterOffsetBegin']) - 1
+			for token in sentence['tokens']:
+				token['characterOffsetBegin'] -= starts[text_idx]
+				token['characterOffsetEnd'] -= starts[text_idx]
+			parsed_texts[text_idx]['sentences'].append(sentence)
+
+		return parsed_texts
+
+	def annotate_request(self, request):
+		'''Annotates a (url, texts) pair, for the thread pool.'''
+
+		return self.annotate_packed(request[1], request[0])
+
+	def parse_batch(self, texts, texts_per_request = 100):
+		'''Parses an iterable of (unicode) strings, texts_per_request strings per request, yields StanfordDocs in the same order.'''
+
+		texts = iter(texts)
+		requests = iter(lambda: list(itertools.islice(texts, texts_per_request)), [])
+		request_idx = 0
+		# Only read as many requests as can be handled at once, so texts can be read lazily
+		while True:
+			window = []
+			for texts_in_request in itertools.islice(requests, self.num_threads):
+				window.append((self.urls[request_idx % len(self.urls)], texts_in_request))
+				request_idx += 1
+			if not window:
+				break
+			for parsed_texts in self.pool.map(self.annotate_request, window):
+				for parsed_text in parsed_texts:
+					yield stanford_to_spacy(parsed_text)
+
+###### SPACY MODELS ######
+# Process-wide registry of loaded Spacy models, shared by the tokenizer, PoS-tagger and parser. Format: {model_name: Language}
+spacy_models = {}
+
+def get_memory_usage():
+	'''Returns the resident memory of the process in MB, or the peak resident memory where that is not available.'''
+
+	if os.path.isfile('/proc/self/status'):
+		with open('/proc/self/status', 'r') as f:
+			for line in f:
+				if line.startswith('VmRSS:'):
+					return int(line.split()[1]) / 1024.
+	# Peak memory in kB on Linux
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+def get_spacy_model(model_name = 'en_core_web_sm'):
+	'''Loads a Spacy model with all its components, once per process, returns the shared instance.'''
+
+	if model_name not in spacy_models:
+		time_0 = time.time()
+		memory_0 = get_memory_usage()
+		print 'Loading Spacy model {0}...'.format(model_name)
+		spacy_models[model_name] = importlib.import_module(model_name).load()
+		print 'Done! Loading Spacy model {0} took {1:.2f} seconds and {2:.0f} MB of memory'.format(model_name, time.time() - time_0, get_memory_usage() - memory_0)
+
+	return spacy_models[model_name]
+
+class SpacyPipeline:
+	'''
+	View of a shared Spacy model which only runs some of its components, behaves 
+	like a Spacy model loaded with those components disabled.
+	'''
+
+	def __init__(self, nlp, disable = []):
+		self.nlp = nlp
+		self.disable = disable
+
+	def __call__(self, text):
+		return self.nlp(text, disable = self.disable)
+
+	def pipe(self, texts, **kwargs):
+		return self.nlp.pipe(texts, disable = self.disable, **kwargs)
+
+	# Everything else, e.g. vocab and tagger, comes from the shared model
+	def __getattr__(self, name):
+		return getattr(self.nlp, name)
+
 ###### PARSING ######
-def load_parser(parser_type):
-	'''Loads Spacy or Stanford CoreNLP'''
+def load_parser(parser_type, num_servers = 1, server_urls = None):
+	'''
+	Loads Spacy or Stanford CoreNLP. For Stanford, uses running CoreNLP servers 
+	at server_urls, or starts num_servers local servers.
+	'''
 
 	time_0 = time.time()
 	print 'Loading parser...'
 	if parser_type == 'spacy':
-		parser = spacy_model.load()
+		parser = SpacyPipeline(get_spacy_model())
 	elif parser_type == 'stanford':
-		parser = StanfordCoreNLP('ext/stanford', memory='6g')
-		parse((parser_type, parser), 'The cat sat on the mat.') # Annotate dummy sentence to force loading of annotation modules
+		servers = []
+		if not server_urls:
+			from stanfordcorenlp import StanfordCoreNLP
+			server_urls = []
+			for i in range(num_servers):
+				# Packed requests take longer than the default server timeout (in ms)
+				servers.append(StanfordCoreNLP('ext/stanford', memory='6g', timeout = 600000))
+				server_urls.append('http://localhost:{0}'.format(servers[-1].port))
+		parser = StanfordClient(server_urls, servers = servers)
+		# Annotate dummy sentence to force loading of annotation modules
+		for server_url in server_urls:
+			parser.annotate(u'The cat sat on the mat.', server_url)
 	print 'Done! Loading parser took {0:.2f} seconds'.format(time.time() - time_0)
 
 	return (parser_type, parser)
 
+# Quotes and dashes which Spacy doesn't process well
+SINGLE_QUOTE_REGEX = re.compile(u'‘|’|❛|❜')
+DOUBLE_QUOTE_REGEX = re.compile(u'“|”|❝|❞')
+PUNCTUATION_DASH_REGEX = re.compile(ur'([^\w\s])([-—])')
+
+def normalize_text(text):
+	'''Prepares a (unicode) string for Spacy, returns normalized unicode string.'''
+
+	# Normalize quotes, ‘ ’ ❛ ❜ to ', and “ ” ❝ ❞ to ", Spacy doesn't process them well
+	text = SINGLE_QUOTE_REGEX.sub(u"'", text)
+	text = DOUBLE_QUOTE_REGEX.sub(u'"', text)
+	# Insert a space between punctuation and a dash, Spacy doesn't process that well either
+	text = PUNCTUATION_DASH_REGEX.sub(r'\1 \2', text)
+
+	return text
+
+def normalize_texts(texts):
+	'''Prepares a list of (unicode) strings for Spacy, returns list of normalized unicode strings.'''
+
+	# Convert to unicode if necessary
+	unicode_texts = []
+	for text in texts:
+		try:
+			text = unicode(text, 'utf-8')
+		except TypeError:
+			pass
+		unicode_texts.append(text)
+	# Normalize all texts at once, joined by newlines, which are never affected by normalization
+	joined_text = u'\n'.join(unicode_texts)
+	if joined_text.count(u'\n') == len(unicode_texts) - 1:
+		return normalize_text(joined_text).split(u'\n') if unicode_texts else []
+	# Texts containing newlines themselves are normalized one by one
+	return [normalize_text(text) for text in unicode_texts]
+
 def parse(parser, text):
 	'''Parses a (unicode) string and returns the parse.'''
 
 	if parser[0] == 'spacy':
+		return parser[1](normalize_texts([text])[0])
+
+	if parser[0] == 'stanford':
 		# Convert to unicode if necessary
 		try:
 			text = unicode(text, 'utf-8')
 		except TypeError:
 			pass
-		# Normalize quotes, ‘ ’ ❛ ❜ to ', and “ ” ❝ ❞ to ", Spacy doesn't process them well
-		text = re.sub(u'‘|’|❛|❜', u"'", text)
-		text = re.sub(u'“|”|❝|❞', u'"', text)
-		# Insert a space between punctuation and a dash, Spacy doesn't process that well either
-		text = re.sub(ur'([^\w\s])([-—])', r'\1 \2', text)
-		return parser[1](text)
+		return stanford_to_spacy(parser[1].annotate(text))
+
+def spacy_to_bytes(parses):
+	'''
+	Serializes a list of Spacy Docs with Doc.to_bytes, without tensors. Returns the bytes of each Doc, plus the
+	strings the Docs use, which the string store of another process may not contain, e.g. new lemmata.
+	'''
+
+	strings = set()
+	for parse in parses:
+		for token in parse:
+			strings.update([token.lemma_, token.tag_, token.dep_, token.ent_type_])
+
+	return [parse.to_bytes(tensor = False) for parse in parses], list(strings)
+
+def spacy_from_bytes(vocab, parses_bytes, strings):
+	'''Turns the output of spacy_to_bytes back into a list of Spacy Docs.'''
+
+	from spacy.tokens import Doc
+	for string in strings:
+		vocab.strings.add(string)
+
+	return [Doc(vocab).from_bytes(parse_bytes, tensor = False) for parse_bytes in parses_bytes]
+
+# Pools of Spacy parsing processes, kept for the whole run, format: {n_process: Pool}
+parse_pools = {}
+# Spacy pipeline of a parsing worker process
+worker_parser = None
+
+def init_parse_worker(disable):
+	'''Sets up a parsing worker process, which is forked with the Spacy model already loaded.'''
+
+	global worker_parser
+	worker_parser = SpacyPipeline(get_spacy_model(), disable)
+
+def parse_to_bytes(texts):
+	'''Parses a batch of normalized texts in a worker process, returns them serialized by spacy_to_bytes.'''
+
+	return spacy_to_bytes(list(worker_parser.pipe(texts, batch_size = len(texts))))
+
+def get_parse_pool(parser, n_process):
+	'''Gets a pool of n_process Spacy parsing processes, started once per run.'''
+
+	if n_process not in parse_pools:
+		parse_pools[n_process] = multiprocessing.Pool(n_process, init_parse_worker, (parser[1].disable,))
+
+	return parse_pools[n_process]
+
+def parse_batch(parser, texts, batch_size = 1000, n_process = 1):
+	'''
+	Parses an iterable of (unicode) strings in batches, yields parses in the same order. Spacy parses
+	batches in n_process worker processes, Stanford packs batch_size strings into a request, and sends
+	requests concurrently.
+	'''
+
+	if parser[0] == 'spacy':
+		# Normalize texts one batch at a time, so they can be read lazily
+		texts = iter(texts)
+		text_batches = (normalize_texts(text_batch) for text_batch in iter(lambda: list(itertools.islice(texts, batch_size)), []))
+		if n_process > 1:
+			# Spacy 2.0 cannot parse in multiple processes itself, so workers parse whole batches and send back bytes
+			pool = get_parse_pool(parser, n_process)
+			vocab = parser[1].vocab
+			# Only hand out a limited number of batches at a time, so texts can be read lazily
+			while True:
+				window = list(itertools.islice(text_batches, n_process * 2))
+				if not window:
+					break
+				for parses_bytes, strings in pool.map(parse_to_bytes, window):
+					for parsed_text in spacy_from_bytes(vocab, parses_bytes, strings):
+						yield parsed_text
+		else:
+			normalized_texts = (text for text_batch in text_batches for text in text_batch)
+			for parsed_text in parser[1].pipe(normalized_texts, batch_size = batch_size):
+				yield parsed_text
 
 	if parser[0] == 'stanford':
-		# Convert from unicode if necessary
-		try:
-			text = text.encode('utf-8')
-		except UnicodeDecodeError:
-			pass
-		properties={'annotators': 'tokenize,ssplit,pos,lemma,depparse','pipelineLanguage':'en','outputFormat':'json'}
-		parsed_text = parser[1].annotate(text, properties=properties)
-		parsed_text = json.loads(parsed_text)
-		return stanford_to_spacy(parsed_text)
+		unicode_texts = (text if isinstance(text, unicode) else unicode(text, 'utf-8') for text in texts)
+		for parsed_text in parser[1].parse_batch(unicode_texts, batch_size):
+			yield parsed_text
+
+###### PARSED CORPUS CACHE ######
+# Version of the cached parse format, change to invalidate existing caches
+PARSE_CACHE_VERSION = 4
+
+def get_parser_version(parser_type):
+	'''Gets version strings of the parser and its model, to invalidate cached parses when they change.'''
+
+	if parser_type == 'spacy':
+		import spacy
+		import en_core_web_sm as spacy_model
+		return [spacy.__version__, getattr(spacy_model, '__version__', '')]
+	elif parser_type == 'stanford' and os.path.isdir('ext/stanford'):
+		# CoreNLP jars are named by version
+		return sorted(os.listdir('ext/stanford'))
+	return []
+
+def get_parse_cache_file(work_dir, corpus, corpus_type, parser_type, no_split = False):
+	'''Gets location of cached corpus parses, named by a hash of the corpus, the parser and its version.'''
+
+	corpus_stat = os.stat(corpus)
+	key = [PARSE_CACHE_VERSION, corpus, corpus_stat.st_size, int(corpus_stat.st_mtime), corpus_type, no_split, parser_type]
+	key += get_parser_version(parser_type)
+	key_hash = hashlib.sha1(json.dumps(key)).hexdigest()
+
+	return os.path.join(work_dir, 'parsed_{0}_{1}.pickle'.format(os.path.basename(corpus), key_hash))
+
+def serialize_parses(parser, parses):
+	'''
+	Turns a list of parses into a compact, picklable format. Spacy Docs are turned into
+	bytes with the strings they use, Stanford parses into lists of token tuples for each sentence.
+	'''
+
+	if parser[0] == 'spacy':
+		return spacy_to_bytes(parses)
+
+	if parser[0] == 'stanford':
+		serialized_parses = [] # Format: [[[(idx, lemma, tag, text, whitespace, lower, head index in sentence, dep)]]]
+		for parse in parses:
+			serialized_parse = []
+			for sent in parse.sents:
+				serialized_parse.append([(token.idx, token.lemma_, token.tag_, token.text, token.text_with_ws[len(token.text):], 
+					token.lower_, token.head_idx, token.dep_) for token in sent])
+			serialized_parses.append(serialized_parse)
+		return serialized_parses
+
+def deserialize_parses(parser, serialized_parses):
+	'''Turns parses in the format of serialize_parses back into a list of Spacy Docs or StanfordDocs.'''
+
+	if parser[0] == 'spacy':
+		return spacy_from_bytes(parser[1].vocab, *serialized_parses)
+
+	if parser[0] == 'stanford':
+		parses = []
+		# Rebuild CoreNLP output, and convert that like a fresh parse
+		for serialized_parse in serialized_parses:
+			sentences = []
+			for sent in serialized_parse:
+				tokens = [{'characterOffsetBegin': idx, 'lemma': lemma, 'pos': tag, 'originalText': text, 'after': ws, 'word': lower} 
+					for idx, lemma, tag, text, ws, lower, head_idx, dep in sent]
+				dependencies = [{'dependent': i + 1, 'governor': token[6] + 1, 'dep': token[7]} for i, token in enumerate(sent)]
+				sentences.append({'tokens': tokens, 'basicDependencies': dependencies})
+			parses.append(stanford_to_spacy({'sentences': sentences}))
+		return parses
+
+def dump_parsed_batch(f, parser, parses):
+	'''Appends a batch of parses of the current document to an open cache file.'''
+
+	pickle.dump(serialize_parses(parser, parses), f, pickle.HIGHEST_PROTOCOL)
+
+def end_parsed_document(f):
+	'''Marks the end of the current document in an open cache file.'''
+
+	pickle.dump(None, f, pickle.HIGHEST_PROTOCOL)
+
+def load_parsed_document(f, parser):
+	'''Reads the cached parses of a single document batch by batch, yields them one by one.'''
+
+	while True:
+		serialized_parses = pickle.load(f)
+		if serialized_parses is None:
+			break
+		for parse in deserialize_parses(parser, serialized_parses):
+			yield parse
+
+def load_parsed_documents(cache_file, parser):
+	'''
+	Reads cached parses, yields an iterator over the parses of each document, in corpus order.
+	Parses are read lazily, one batch at a time.
+	'''
+
+	file_size = os.path.getsize(cache_file)
+	with open(cache_file, 'rb') as f:
+		while f.tell() < file_size:
+			parses = load_parsed_document(f, parser)
+			yield parses
+			# Skip parses the caller did not read, to get to the next document
+			for parse in parses:
+				pass
 
 ###### POS-TAGGING ######
 def load_pos_tagger():
@@ -175,14 +531,16 @@ def load_pos_tagger():
 	
 	time_0 = time.time()
 	print 'Loading PoS-tagger...'
-	pos_tagger = spacy_model.load(disable = ['ner', 'parser'])
+	pos_tagger = SpacyPipeline(get_spacy_model(), disable = ['ner', 'parser'])
 	print 'Done! Loading PoS-tagger took {0:.2f} seconds'.format(time.time() - time_0)
 
 	return pos_tagger
 
-def pos_tag(pos_tagger, text):
-	'''Takes pos_tagger and tokenized utf-8 idiom/sentence, returns list of word|POS strings.'''
-	
+def make_tagger_doc(pos_tagger, text):
+	'''Makes Doc of a tokenized utf-8 idiom/sentence, as a single sentence, for the PoS-tagger.'''
+
+	import spacy
+
 	# Normalize quotes, ‘ ’ ❛ ❜ to ', and “ ” ❝ ❞ to ", Spacy doesn't process them well
 	text = re.sub(u'‘|’|❛|❜', u"'", text)
 	text = re.sub(u'“|”|❝|❞', u'"', text)
@@ -194,8 +552,14 @@ def pos_tag(pos_tagger, text):
 			token.is_sent_start = True
 		else:
 			token.is_sent_start = False
+
+	return doc
+
+def pos_tag(pos_tagger, text):
+	'''Takes pos_tagger and tokenized utf-8 idiom/sentence, returns list of word|POS strings.'''
+	
 	# Do actual tagging
-	doc = pos_tagger.tagger(doc)
+	doc = pos_tagger.tagger(make_tagger_doc(pos_tagger, text))
 	# Convert into list of words and tags
 	words_and_tags = []
 	for token in doc:
@@ -203,11 +567,35 @@ def pos_tag(pos_tagger, text):
 		
 	return words_and_tags
 
+def tag_batch(pos_tagger, texts, batch_size = 1000):
+	'''
+	Takes pos_tagger and list of tokenized utf-8 idioms/sentences, tags them in batches,
+	returns list of lists of (word, POS, lemma) tuples.
+	'''
+
+	docs = [make_tagger_doc(pos_tagger, text) for text in texts]
+	# Only tag non-empty Docs, empty ones have no tags anyway
+	tagged_docs = iter(pos_tagger.tagger.pipe([doc for doc in docs if len(doc) > 0], batch_size = batch_size))
+	tagged_texts = []
+	for doc in docs:
+		if len(doc) > 0:
+			doc = next(tagged_docs)
+		tagged_texts.append([(token.text, token.tag_, token.lemma_) for token in doc])
+
+	return tagged_texts
+
+def pos_tag_batch(pos_tagger, texts, batch_size = 1000):
+	'''
+	Takes pos_tagger and list of tokenized utf-8 idioms/sentences, tags them in batches,
+	returns list of lists of word|POS strings, like pos_tag.
+	'''
+
+	return [[word + u'|' + tag for word, tag, lemma in tagged_text] for tagged_text in tag_batch(pos_tagger, texts, batch_size = batch_size)]
+
 ###### MORPHA ######	
-def morpha(morph_dir, tokens, keep_case = True, keep_pos = False):
-	'''Interface to morpha and its options, takes list of tokens as input, returns list of uninflected tokens.'''
+def get_morph_flags(keep_case, keep_pos):
+	'''Gets command-line flags for morpha and morphg.'''
 
-	# Set flags
 	if keep_case:
 		case_flag = 'c'
 	else:
@@ -216,48 +604,188 @@ def morpha(morph_dir, tokens, keep_case = True, keep_pos = False):
 		pos_flag = 't'
 	else:
 		pos_flag = ''
-	flags = '-{0}{1}f'.format(case_flag, pos_flag)
 
-	# Call morpha via subprocess
-	call = shlex.split('{0}/morpha {1} {0}/verbstem.list'.format(morph_dir, flags))
+	return '-{0}{1}f'.format(case_flag, pos_flag)
+
+def run_morph_tool(morph_dir, tool, flags, lines):
+	'''
+	Runs morpha or morphg once on a batch of lines, one line per list of tokens,
+	returns a list of output tokens for each line. Both tools keep line breaks.
+	'''
+
+	call = shlex.split('{0}/{1} {2} {0}/verbstem.list'.format(morph_dir, tool, flags))
 	process = subprocess.Popen(call, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-	output = process.communicate(input=' '.join(tokens))
-	base_tokens = output[0].split(' ')
+	output = process.communicate(input='\n'.join([' '.join(tokens) for tokens in lines]) + '\n')
+	# Pad the output, in case a tool fails on some of the lines
+	output_lines = output[0].split('\n') + [''] * len(lines)
 
-	return base_tokens
+	return [output_line.strip(' ').split(' ') for output_line in output_lines[:len(lines)]]
 
-def morphg(morph_dir, tokens, keep_case = True, keep_pos = False):
-	'''Interface to morphg and its options, takes list of token+inflection_POS strings as input, returns tuple of inflected tokens.'''
+def run_morph_tool_batches(morph_dir, tool, flags, lines, batch_size = 1000, num_workers = 1):
+	'''
+	Runs morpha or morphg on batches of lines, rather than once per line, optionally 
+	running several batches in parallel. Returns a list of output tokens for each line.
+	'''
 
-	# Set flags
-	if keep_case:
-		case_flag = 'c'
-	else:
-		case_flag = ''
-	if keep_pos:
-		pos_flag = 't'
+	batches = [lines[i:i + batch_size] for i in range(0, len(lines), batch_size)]
+	if num_workers > 1 and len(batches) > 1:
+		# The work is done by the morph tools, so threads suffice to run them in parallel
+		pool = ThreadPool(min(num_workers, len(batches)))
+		batch_outputs = pool.map(lambda batch: run_morph_tool(morph_dir, tool, flags, batch), batches)
+		pool.close()
+		pool.join()
 	else:
-		pos_flag = ''
-	flags = '-{0}{1}f'.format(case_flag, pos_flag)
+		batch_outputs = [run_morph_tool(morph_dir, tool, flags, batch) for batch in batches]
 
-	# Call morphg
-	call = shlex.split('{0}/morphg {1} {0}/verbstem.list'.format(morph_dir, flags))
-	process = subprocess.Popen(call, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-	output = process.communicate(input=' '.join(tokens))
-	inflected_tokens = output[0].split(' ')
+	return [output_tokens for batch_output in batch_outputs for output_tokens in batch_output]
+
+def morpha_batch(morph_dir, token_lists, keep_case = True, keep_pos = False, num_workers = 1, batch_size = 1000):
+	'''Interface to morpha and its options, takes list of lists of tokens as input, returns list of lists of uninflected tokens.'''
+
+	return run_morph_tool_batches(morph_dir, 'morpha', get_morph_flags(keep_case, keep_pos), token_lists, batch_size = batch_size, num_workers = num_workers)
+
+def morphg_batch(morph_dir, token_lists, keep_case = True, keep_pos = False, num_workers = 1, batch_size = 1000):
+	'''Interface to morphg and its options, takes list of lists of token+inflection_POS strings as input, returns list of tuples of inflected tokens.'''
+
+	inflected_token_lists = run_morph_tool_batches(morph_dir, 'morphg', get_morph_flags(keep_case, keep_pos), token_lists, batch_size = batch_size, num_workers = num_workers)
 
 	# Filter out failed inflections, which will still contain '+'
-	cleaned_inflected_tokens = [i_t for i_t in inflected_tokens if not '+' in i_t]
+	return [tuple([i_t for i_t in inflected_tokens if i_t and not '+' in i_t]) for inflected_tokens in inflected_token_lists]
+
+def morpha(morph_dir, tokens, keep_case = True, keep_pos = False):
+	'''Interface to morpha and its options, takes list of tokens as input, returns list of uninflected tokens.'''
+
+	return morpha_batch(morph_dir, [tokens], keep_case = keep_case, keep_pos = keep_pos)[0]
+
+def morphg(morph_dir, tokens, keep_case = True, keep_pos = False):
+	'''Interface to morphg and its options, takes list of token+inflection_POS strings as input, returns tuple of inflected tokens.'''
 
-	return tuple(cleaned_inflected_tokens)
+	return morphg_batch(morph_dir, [tokens], keep_case = keep_case, keep_pos = keep_pos)[0]
 
 ###### TOKENIZATION ######
-def load_tokenizer():
-	'''Loads Spacy tokenizer'''
+class SimpleToken:
+	'''Spacy-Token-like container for simple tokenizer output'''
+
+	def __init__(self, i, idx, text, ws):
+		self.i = i # Token index in document
+		self.idx = idx # Starting character index in document
+		self.text = text
+		self.text_with_ws = text + ws
+
+	def __repr__(self):
+		return self.text
+
+class SimpleDoc:
+	'''Spacy-Doc-like container for simple tokenizer output, slices are SimpleDocs too'''
+
+	def __init__(self, tokens):
+		self.tokens = tokens
+		self.text = ''.join([token.text_with_ws for token in self.tokens[:-1]] + [token.text for token in self.tokens[-1:]])
+
+	def __iter__(self):
+		return iter(self.tokens)
+
+	def __len__(self):
+		return len(self.tokens)
+
+	def __getitem__(self, i):
+		if isinstance(i, slice):
+			return SimpleDoc(self.tokens[i.start:i.stop])
+		else:
+			return self.tokens[i]
+
+class SimpleTokenizer:
+	'''
+	Regex-based tokenizer which approximates the token boundaries of the Spacy
+	English tokenizer on ordinary text: splits on spaces, splits off leading
+	and trailing punctuation and clitics ('s, n't, 're, etc.), and splits
+	hyphenated words. Loads instantly, for when only token offsets are needed.
+	'''
+
+	# Standalone clitics and abbreviations which are not split further
+	exceptions = set([u"'s", u"'S", u"’s", u"n't", u"N'T", u"n’t", u"'m", u"'re", u"'ve", u"'ll", u"'d", u"’m", u"’re", u"’ve", u"’ll", u"’d",
+		u'Mr.', u'Mrs.', u'Ms.', u'Dr.', u'St.', u'Jr.', u'Sr.', u'Prof.', u'Mt.', u'etc.', u'vs.', u'approx.', u'Inc.', u'Ltd.', u'Co.', u'Corp.',
+		u'Jan.', u'Feb.', u'Mar.', u'Apr.', u'Jun.', u'Jul.', u'Aug.', u'Sep.', u'Sept.', u'Oct.', u'Nov.', u'Dec.'])
+	abbreviation_regex = re.compile(ur'^(?:[^\W\d_]\.){2,}$', re.U) # E.g. U.S., e.g., a.m.
+	prefix_regex = re.compile(ur'^(?:\.\.+|…|["\'`(\[{<‘“«¿¡$£€#§])', re.U)
+	suffix_regex = re.compile(ur'(?:(?<=[^\W\d_])(?:[\'’](?:s|S|m|M|re|ve|ll|d)|n[\'’]t|N\'T)|\.\.+|…|["\'’”)\]}>,;:!?»%]|(?<=[a-z0-9%)\]"\'’”])\.|(?<=[A-Z][A-Z])\.)$', re.U)
+	infix_regex = re.compile(ur'\.\.+|…|(?<=[0-9])[+\-*^](?=[0-9-])|(?<=[a-z])\.(?=[A-Z])|(?<=[^\W\d_]),(?=[^\W\d_])|(?<=[^\W\d_])(?:---|--|——|-|–|—|~)(?=[^\W\d_])|(?<=[^\W_])[:<>=/](?=[^\W\d_])', re.U)
+
+	def split_chunk(self, chunk):
+		'''Splits a string without spaces into token strings.'''
+
+		prefixes = []
+		suffixes = []
+		# Alternately split off prefixes and suffixes
+		while chunk and chunk not in self.exceptions and not self.abbreviation_regex.match(chunk):
+			prefix = self.prefix_regex.match(chunk)
+			if prefix and prefix.end() < len(chunk):
+				prefixes.append(prefix.group())
+				chunk = chunk[prefix.end():]
+				continue
+			suffix = self.suffix_regex.search(chunk)
+			if suffix and suffix.start() > 0:
+				suffixes.insert(0, suffix.group())
+				chunk = chunk[:suffix.start()]
+				continue
+			break
+		# Split remainder on infixes
+		tokens = []
+		position = 0
+		if chunk not in self.exceptions:
+			for infix in self.infix_regex.finditer(chunk):
+				if infix.start() > position:
+					tokens.append(chunk[position:infix.start()])
+				tokens.append(infix.group())
+				position = infix.end()
+		if position < len(chunk):
+			tokens.append(chunk[position:])
+
+		return prefixes + tokens + suffixes
+
+	def __call__(self, text):
+		'''Tokenizes a (unicode) string, returns a SimpleDoc.'''
+
+		# Format: (idx, text)
+		token_offsets = []
+		for chunk in re.finditer(u'[^ ]+| +', text):
+			if chunk.group()[0] == u' ':
+				# The first space is whitespace of the preceding token, any other spaces form a token
+				spaces = chunk.group()
+				if token_offsets:
+					spaces = spaces[1:]
+				if spaces:
+					token_offsets.append((chunk.end() - len(spaces), spaces))
+			else:
+				idx = chunk.start()
+				for token_text in self.split_chunk(chunk.group()):
+					token_offsets.append((idx, token_text))
+					idx += len(token_text)
+		# Single space after a token is its whitespace
+		tokens = []
+		for i, (idx, token_text) in enumerate(token_offsets):
+			ws = text[idx + len(token_text):idx + len(token_text) + 1]
+			if ws != u' ' or token_text[0] == u' ':
+				ws = u''
+			tokens.append(SimpleToken(i, idx, token_text, ws))
+
+		return SimpleDoc(tokens)
+
+	def pipe(self, texts, batch_size = 1000):
+		'''Tokenizes an iterable of (unicode) strings, yields SimpleDocs, like Spacy's pipe.'''
+
+		for text in texts:
+			yield self(text)
+
+def load_tokenizer(tokenizer_type = 'spacy'):
+	'''Loads Spacy tokenizer, or the simple tokenizer'''
 
 	time_0 = time.time()
 	print 'Loading tokenizer...'
-	tokenizer = spacy_model.load(disable = ['tagger', 'ner', 'parser'])
+	if tokenizer_type == 'spacy':
+		tokenizer = SpacyPipeline(get_spacy_model(), disable = ['tagger', 'ner', 'parser'])
+	elif tokenizer_type == 'simple':
+		tokenizer = SimpleTokenizer()
 	print 'Done! Loading tokenizer took {0:.2f} seconds'.format(time.time() - time_0)
 
 	return tokenizer
@@ -269,6 +797,18 @@ def tokenize(tokenizer, sentence):
 	except TypeError:
 		return tokenizer(sentence)
 
+def tokenize_batch(tokenizer, sentences, batch_size = 1000):
+	'''Parses a list of (unicode) sentences in batches, returns list of Spacy Docs'''
+
+	unicode_sentences = []
+	for sentence in sentences:
+		try:
+			unicode_sentences.append(unicode(sentence, 'utf-8'))
+		except TypeError:
+			unicode_sentences.append(sentence)
+
+	return list(tokenizer.pipe(unicode_sentences, batch_size = batch_size))
+
 ###### EXAMPLE SENTENCES ######
 def get_example_sentences(idioms, sentences_file, cache_file):
 	'''
@@ -299,27 +839,56 @@ def get_example_sentences(idioms, sentences_file, cache_file):
 		idioms_with_sentences[idiom] = '' 
 	# Compile idiom regexes for efficiency and ignore meta-linguistic uses in quotes
 	idiom_regexes = [re.compile('[^"\'] ' + idiom + ' [^"\']') for idiom in idioms]
+	# Index idioms by their rarest word, so each line is only searched for idioms whose anchor it contains
+	# Idioms containing regex special characters are searched for in every line
+	idiom_words = []
+	for idiom in idioms:
+		if not re.search(r'[.^$*+?{}\[\]\\|()]', idiom):
+			idiom_words.append(idiom_matcher.WORD_REGEX.findall(idiom))
+		else:
+			idiom_words.append([])
+	anchor_index = idiom_matcher.AnchorIndex(idiom_words)
+	num_lines = [0 for idiom in idioms] # Number of lines containing each idiom
+	num_finished_idioms = 0 # Number of idioms found in 1000 lines, which are not searched for anymore
+	num_read_lines = 0
+	num_skipped = 0
 	# Find shortest (in tokens) sentence containing idiom in corpus
+	import nltk.data
 	splitter = nltk.data.load('tokenizers/punkt/english.pickle')
-	# Extract first 1000 lines containing the idiom with grep, then split and find sentences
-	for idx, idiom in enumerate(idioms):
-		if idx%100 == 0 and idx > 0:
-			print '\tGetting example sentences for {0} of {1} idioms took {2} seconds'.format(idx, len(idioms), time.time()-time_0)
-		call = shlex.split('grep -m 1000 "{0}" {1}'.format(u8(idiom), sentences_file))
-		process = subprocess.Popen(call, stdin=subprocess.PIPE, stdout = subprocess.PIPE, stderr=subprocess.PIPE)
-		output = process.communicate()
-		output = output[0].strip()
-		sentences = splitter.tokenize(unicode(output, 'utf-8'))
-		for sentence in sentences:
-			if idiom_regexes[idx].search(sentence):
-				# Should have at least 3 extra words in the 'sentence'
-				if len(sentence.split(' ')) > len(idiom.split(' ')) + 3:
-					if idioms_with_sentences[idiom]:
-						# Replace old sentence if new sentence one is shorter
-						if len(sentence.split(' ')) < len(idioms_with_sentences[idiom].split(' ')): 
-							idioms_with_sentences[idiom] = sentence
-					else:
-						idioms_with_sentences[idiom] = sentence
+	# Go through the corpus once, consider the first 1000 lines containing an idiom, then split and find sentences
+	with open(sentences_file, 'r') as f:
+		for line_idx, line in enumerate(f):
+			# Stop reading once all idioms have been found in 1000 lines
+			if num_finished_idioms == len(idioms):
+				break
+			if line_idx%1000000 == 0 and line_idx > 0:
+				print '\tGetting example sentences from {0} lines took {1} seconds'.format(line_idx, time.time()-time_0)
+			num_read_lines += 1
+			line = unicode(line.strip(), 'utf-8')
+			words = idiom_matcher.WORD_REGEX.findall(line)
+			anchor_index.count_words(words)
+			candidate_idxs = [idx for idx in anchor_index.get_candidates(words) if num_lines[idx] < 1000 and idioms[idx] in line]
+			if not candidate_idxs:
+				num_skipped += 1
+				continue
+			for idx in candidate_idxs:
+				num_lines[idx] += 1
+				if num_lines[idx] == 1000:
+					num_finished_idioms += 1
+			sentences = splitter.tokenize(line)
+			for sentence in sentences:
+				for idx in candidate_idxs:
+					idiom = idioms[idx]
+					if idiom_regexes[idx].search(sentence):
+						# Should have at least 3 extra words in the 'sentence'
+						if len(sentence.split(' ')) > len(idiom.split(' ')) + 3:
+							if idioms_with_sentences[idiom]:
+								# Replace old sentence if new sentence one is shorter
+								if len(sentence.split(' ')) < len(idioms_with_sentences[idiom].split(' ')): 
+									idioms_with_sentences[idiom] = sentence
+							else:
+								idioms_with_sentences[idiom] = sentence
+	print 'Prefilter skipped {0} of {1} lines'.format(num_skipped, num_read_lines)
 
 	# Caching extracted example sentences
 	ofn = cache_file
@@ -402,48 +971,146 @@ def parse_idiom(idiom, ambiguous_word, parser):
 
 	return parsed_idiom	
 
-def inflect_idioms(idioms, morph_dir):
+def get_inflection_version(morph_dir, backend = 'morph'):
+	'''Gets the inflection backend and the versions of the PoS-tagger and morph tools, to invalidate cached inflections when they change.'''
+
+	import spacy
+	import en_core_web_sm as spacy_model
+	key = [backend, spacy.__version__, getattr(spacy_model, '__version__', '')]
+	for file_name in ['morpha', 'morphg', 'verbstem.list']:
+		file_path = os.path.join(morph_dir, file_name)
+		if os.path.exists(file_path):
+			file_stat = os.stat(file_path)
+			key.append([file_name, file_stat.st_size, int(file_stat.st_mtime)])
+
+	return key
+
+def get_inflection_cache_file(work_dir, morph_dir, backend = 'morph'):
+	'''Gets location of cached idiom inflections, named by a hash of the inflection backend and the versions of the PoS-tagger and morph tools.'''
+
+	key = get_inflection_version(morph_dir, backend)
+	key_hash = hashlib.sha1(json.dumps(key)).hexdigest()
+
+	return os.path.join(work_dir, 'inflections_{0}.json'.format(key_hash))
+
+def get_inflections(idioms, morph_dir, num_workers = 1, cache_file = None, backend = 'morph'):
+	'''
+	Gets inflectional variants of idiom words, returns a mapping between idioms
+	and a list containing a tuple of word forms for each word. Optionally, reads
+	inflections from a cache file, only inflects idioms which are not in the 
+	cache yet, and adds those to the cache file.
+	'''
+
+	cached_inflections = {} # Format: {'idiom': [['base form', 'inflected form', ...]]}, empty list for untaggable idioms
+	if cache_file and os.path.isfile(cache_file):
+		cached_inflections = json.load(open(cache_file, 'r'))
+	new_idioms = sorted(set([idiom for idiom in idioms if idiom not in cached_inflections]))
+	if cache_file:
+		print 'Using cached inflections of {0} idioms, inflecting {1} new idioms'.format(len(set(idioms)) - len(new_idioms), len(new_idioms))
+
+	if new_idioms:
+		new_inflections = generate_inflections(new_idioms, morph_dir, num_workers = num_workers, backend = backend)
+		for idiom in new_idioms:
+			cached_inflections[idiom] = new_inflections.get(idiom, [])
+		if cache_file:
+			# Write to temporary file, so that an interrupted run does not leave a truncated cache
+			with open(cache_file + '.tmp', 'w') as of:
+				json.dump(cached_inflections, of)
+			os.rename(cache_file + '.tmp', cache_file)
+			print 'Caching inflections in {0}'.format(cache_file)
+
+	return {idiom: [tuple(word_forms) for word_forms in cached_inflections[idiom]] for idiom in idioms if cached_inflections[idiom]}
+
+def generate_inflections(idioms, morph_dir, num_workers = 1, backend = 'morph'):
+	'''
+	Generate inflectional variants of idiom words using the Spacy PoS-tagger,
+	morpha and morphg. Takes a list of idioms, returns a mapping between
+	idioms and a list containing a tuple of word forms for each word. The
+	PoS-tagger, morpha and morphg are run on batches of idioms, rather than
+	once per idiom. With the 'python' backend, Spacy lemmata replace morpha,
+	and the Python inflector replaces morphg, so the morph tools are not used.
+	'''
+	
+	pos_tagger = load_pos_tagger()
+	inflections = {} # Format: {'idiom': [('base form', 'inflected form', ...)]}
+
+	# Tag tokens, convert to Morpha tags
+	tagged_idioms = []
+	morpha_token_lists = []
+	lemma_lists = []
+	for idiom, tagged_tokens in zip(idioms, tag_batch(pos_tagger, idioms)):
+		if tagged_tokens:
+			tagged_idioms.append(idiom)
+			morpha_token_lists.append([pos2morpha.convert_token(word + u'|' + tag).encode('utf-8') for word, tag, lemma in tagged_tokens])
+			lemma_lists.append([lemma.encode('utf-8') for word, tag, lemma in tagged_tokens])
+	# Run morpha, or use Spacy lemmata of verbs and nouns in the same format
+	if backend == 'python':
+		base_token_lists = []
+		for morpha_tokens, lemmata in zip(morpha_token_lists, lemma_lists):
+			base_tokens = []
+			for morpha_token, lemma in zip(morpha_tokens, lemmata):
+				word, tag = morpha_token.rsplit('_', 1)
+				if tag[0:1] == 'V' or tag[0:2] == 'NN':
+					# Spacy lemmata are lower-cased, keep case like morpha
+					if word[0:1].isupper():
+						lemma = lemma[0:1].upper() + lemma[1:]
+					word = lemma
+				base_tokens.append(word + '_' + tag)
+			base_token_lists.append(base_tokens)
+	else:
+		base_token_lists = morpha_batch(morph_dir, morpha_token_lists, keep_case = True, keep_pos = True, num_workers = num_workers)
+
+	# Collect inflections to generate for verbs and nouns
+	morphg_token_lists = []
+	for base_tokens in base_token_lists:
+		for base_token in base_tokens:
+			# Look for NN, not N, because we don't want NP, proper names
+			# Differentiate noun and verb inflections
+			if base_token[0:4] != 'be_V' and '_V' in base_token:
+				morphg_token_lists.append((re.sub('_', '+s_', base_token), re.sub('_', '+ing_', base_token),
+				re.sub('_', '+ed_', base_token), re.sub('_', '+en_', base_token)))
+			elif base_token[0:4] != 'be_V' and '_NN' in base_token:
+				morphg_token_lists.append((re.sub('_', '+s_', base_token),))
+	# Run morphg, or the Python inflector
+	if backend == 'python':
+		inflected_token_lists = iter(inflector.Inflector(os.path.join(morph_dir, 'verbstem.list')).inflect_tokens(morphg_token_lists))
+	else:
+		inflected_token_lists = iter(morphg_batch(morph_dir, morphg_token_lists, keep_case = True, keep_pos = False, num_workers = num_workers))
+
+	for idiom, base_tokens in zip(tagged_idioms, base_token_lists):
+		base_tuples = []
+		for base_token in base_tokens:
+			# Morphg doesn't handle 'be' well, define manually
+			if base_token[0:4] == 'be_V':
+				base_tuples.append(('be', 'being', 'been', 'am', 'are', 'is', 'was', 'were'))
+			elif '_V' in base_token or '_NN' in base_token:
+				base_tuples.append((base_token.split('_')[0],) + next(inflected_token_lists))
+			else:
+				base_tuples.append((base_token.split('_')[0],))
+		inflections[idiom] = [tuple([unicode(form, 'utf-8') for form in base_tuple]) for base_tuple in base_tuples]
+
+	return inflections
+
+def inflect_idioms(idioms, morph_dir, num_workers = 1, cache_file = None, backend = 'morph'):
 	'''
 	Generate inflectional variants of idioms using the Spacy PoS-tagger,
 	morpha and morphg. Takes a list of idioms, returns a list of inflected
 	idioms and a mapping between inflectional variants and the base form.
 	'''
 	
-	pos_tagger = load_pos_tagger()
 	inflected_idioms = []
 	base_form_map = {} # Maps inflectional variants to base form, format: {'inflectional variant': 'base form'}
 	print 'Inflecting idioms...'
 	time_0 = time.time()	
 
+	inflections = get_inflections(idioms, morph_dir, num_workers = num_workers, cache_file = cache_file, backend = backend)
 	for idiom in idioms:
 		# Add original form to base form map
 		base_form_map[idiom] = idiom
-		# Tag tokens, convert to Morpha tags
-		pos_tokens = pos_tag(pos_tagger, idiom)
-		if pos_tokens:
-			morpha_tokens = [pos2morpha.convert_token(pos_token).encode('utf-8') for pos_token in pos_tokens]
-			# Run morpha
-			base_tokens = morpha(morph_dir, morpha_tokens, keep_case = True, keep_pos = True)
-			# Generate inflections for verbs and nouns
-			base_tuples = []
-			for base_token in base_tokens:
-				# Look for NN, not N, because we don't want NP, proper names
-				# Differentiate noun and verb inflections
-				# Morphg doesn't handle 'be' well, define manually
-				if base_token[0:4] == 'be_V':
-					base_tuples.append(('be', 'being', 'been', 'am', 'are', 'is', 'was', 'were'))
-				elif '_V' in base_token or '_NN' in base_token:
-					if '_V' in base_token:
-						morphg_tokens = (re.sub('_', '+s_', base_token), re.sub('_', '+ing_', base_token),
-						re.sub('_', '+ed_', base_token), re.sub('_', '+en_', base_token))
-					else:
-						morphg_tokens = (re.sub('_', '+s_', base_token),)
-					base_tuples.append((base_token.split('_')[0],) + morphg(morph_dir, morphg_tokens, keep_case = True, keep_pos = False))
-				else:
-					base_tuples.append((base_token.split('_')[0],))
-			# Generate combinations of inflected tokens and store base form mapping
-			for inflected_tokens in itertools.product(*base_tuples):
-				inflected_idiom = unicode(' '.join(inflected_tokens), 'utf-8')
+		# Generate combinations of inflected tokens and store base form mapping
+		if idiom in inflections:
+			for inflected_tokens in itertools.product(*inflections[idiom]):
+				inflected_idiom = ' '.join(inflected_tokens)
 				inflected_idioms.append(inflected_idiom)
 				base_form_map[inflected_idiom] = idiom
 
@@ -455,6 +1122,54 @@ def inflect_idioms(idioms, morph_dir):
 
 	return inflected_idioms, base_form_map
 
+def lemmatize_idioms(idioms, morph_dir, num_workers = 1, cache_file = None, backend = 'morph'):
+	'''
+	Generate inflectional variants of idiom words, like inflect_idioms, but
+	rather than generating all combinations of inflected words, keep the set
+	of word forms of each word, to be matched by a single pattern. Returns
+	the list of idioms in base form, a list of the word forms of each word 
+	in those idioms (None for words without inflections), and a list of 
+	the original idioms, all indexed alike. Original idioms which are not 
+	covered by their base form and word forms are kept as separate idioms.
+	'''
+
+	lemmatized_idioms = []
+	lemmatized_inflections = []
+	base_forms = []
+	print 'Lemmatizing idioms...'
+	time_0 = time.time()
+
+	inflections = get_inflections(idioms, morph_dir, num_workers = num_workers, cache_file = cache_file, backend = backend)
+	seen = set()
+	for idiom in idioms:
+		variants = [(idiom, None)]
+		if idiom in inflections:
+			base_tuples = inflections[idiom]
+			idiom_words = idiom.split(' ')
+			lemmatized_idiom = ' '.join([base_tuple[0] for base_tuple in base_tuples])
+			word_forms = [base_tuple if len(base_tuple) > 1 else None for base_tuple in base_tuples]
+			# Keep the original form if it is not one of the combinations of word forms
+			if len(idiom_words) == len(base_tuples) and all([idiom_word in base_tuple for idiom_word, base_tuple in zip(idiom_words, base_tuples)]):
+				variants = [(lemmatized_idiom, word_forms)]
+			else:
+				variants.append((lemmatized_idiom, word_forms))
+		for lemmatized_idiom, word_forms in variants:
+			if word_forms and any(word_forms):
+				key = (lemmatized_idiom, tuple(word_forms))
+			else:
+				key = (lemmatized_idiom, None)
+				word_forms = None
+			if key not in seen:
+				seen.add(key)
+				lemmatized_idioms.append(lemmatized_idiom)
+				lemmatized_inflections.append(word_forms)
+				base_forms.append(idiom)
+
+	print 'Done! Lemmatizing idioms took {0:.2f} seconds'.format(time.time() - time_0)
+	print 'With inflections, we have {0} idioms'.format(len(lemmatized_idioms))
+
+	return lemmatized_idioms, lemmatized_inflections, base_forms
+
 def expand_indefinite_pronouns(idioms):
 	'''
 	When one's or someone's or someone occurs in an idiom, remove it,
@@ -499,8 +1214,12 @@ def u8(u):
 	return u.encode('utf-8')
 	
 def write_csv(extracted_idioms, outfile):
-	'''Writes extracted idioms to file in csv-format'''
+	'''
+	Writes extracted idioms to file in csv-format, returns number of rows written.
+	Takes any iterable, so a generator of extracted idioms is written as it goes.
+	'''
 	
+	num_rows = 0
 	with open(outfile, 'w') as of:
 		writer = csv.writer(of, delimiter = '\t', quoting=csv.QUOTE_MINIMAL, quotechar = '"')
 		for extracted_idiom in extracted_idioms:
@@ -508,3 +1227,6 @@ def write_csv(extracted_idioms, outfile):
 				u8(extracted_idiom['snippet']), u8(extracted_idiom['bnc_document_id']), u8(extracted_idiom['bnc_sentence']), 
 				extracted_idiom['bnc_char_start'], extracted_idiom['bnc_char_end']]
 			writer.writerow(output_row)
+			num_rows += 1
+
+	return num_rows